@@ -0,0 +1,522 @@
+"""Parsing and rendering of Tumblr dashboard XML into Atom feeds.
+
+Kept free of request handling, so that it can be used from the app and from
+the command-line tools alike.
+"""
+import time
+import hashlib
+
+from StringIO import StringIO
+from feedformatter.feedformatter import Feed, Entry, Link, Person
+try:
+  from xml.etree.cElementTree import XML, iterparse
+except ImportError:
+  from xml.etree.ElementTree import XML, iterparse
+
+def feed_url(url):
+  """Normalize a configured feed URL so that it points at atom.xml."""
+  if url.endswith('atom.xml'):
+    return url
+  elif url[-1] == '/':
+    return url+'atom.xml'
+  else:
+    return url+'/atom.xml'
+
+def entry_ids(atom):
+  """Find the ids of all entries in an Atom feed.
+  
+  :param string atom: An Atom feed's XML, as made by xml_to_atom
+  :returns: A list of entry ids, in feed order
+  """
+  if not atom:
+    return []
+  
+  ns = '{http://www.w3.org/2005/Atom}'
+  et = XML(atom.encode('utf-8') if isinstance(atom, unicode) else atom)
+  return [entry.findtext(ns+'id') for entry in et.findall(ns+'entry')]
+
+def parse_posts(xml):
+  """Find the <post> elements in the XML from Tumblr.
+  
+  :param string xml: Raw XML returned from Tumblr
+  :returns: A list of post Elements, most recent first
+  """
+  return XML(xml).find('posts').findall('post')
+
+def iter_posts(xml):
+  """Yield the <post> elements in the XML from Tumblr as they are parsed.
+  
+  Parsing stops as soon as no more posts are wanted, so taking the first
+  few posts doesn't parse the rest of the document.
+  
+  :param string xml: Raw XML returned from Tumblr
+  """
+  if isinstance(xml, unicode):
+    xml = xml.encode('utf-8')
+  for event, elem in iterparse(StringIO(xml)):
+    if elem.tag == 'post':
+      yield elem
+
+def reblog_key(post):
+  """Identify the original post that a dashboard post is, or is a reblog of.
+  
+  Reblogs of the same root post share a key, regardless of who reblogged
+  them, and the root post itself has the same key (its URL). Dumps without
+  the reblogged-root attributes fall back to a hash of the post's content,
+  which only matches other reblogs.
+  
+  :param Element post: A <post> element from the Tumblr XML
+  :returns: A string key, or None if the post has no URL
+  """
+  if not post.attrib.has_key('reblogged-from-name'):
+    return post.attrib.get('url')
+  if post.attrib.has_key('reblogged-root-url'):
+    return post.attrib.get('reblogged-root-url')
+  
+  digest = hashlib.md5()
+  digest.update(post.attrib.get('type', ''))
+  for child in post:
+    # The tumblelog and tags belong to the reblogger, not the root post
+    if child.tag in ('tumblelog', 'tag'):
+      continue
+    for elem in child.getiterator():
+      digest.update(elem.tag)
+      if elem.text:
+        digest.update(elem.text.encode('utf-8'))
+  return 'md5:'+digest.hexdigest()
+
+def reblog_id(key):
+  """The entry id for everything collapsed under a reblog key.
+  
+  It stays the same as more reblogs of the root post come and go.
+  """
+  if key.startswith('md5:'):
+    return 'urn:'+key
+  return key
+
+def _intern(string):
+  """Intern strings that repeat across posts, like blog names and URLs."""
+  if type(string) is str:
+    return intern(string)
+  return string
+
+def reblogger(post):
+  """The (name, url) of the tumblelog that reblogged a post.
+  
+  :returns: None if the post isn't a reblog, so the root post's author is
+    never credited as one of its rebloggers
+  """
+  if not post.attrib.has_key('reblogged-from-name'):
+    return None
+  author = post.find('tumblelog')
+  return (_intern(author.attrib.get('name')), _intern(author.attrib.get('url')))
+
+# max-width of each of Tumblr's photo-url sizes, largest first
+PHOTO_WIDTHS = (1280, 500, 400, 250, 100, 75)
+
+class Post(Entry):
+  """A feed entry for a dashboard post.
+  
+  Photo posts also keep a manifest of every size of every photo, and the
+  content that follows the photos, so that they can be made again at any
+  image size (see resize) without going back to the XML.
+  """
+  __slots__ = ("photos", "extra")
+  _fields = Entry._fields + __slots__
+
+def img_width(img_size):
+  """The largest photo width for an img_size (0-5); None means no limit."""
+  if not img_size:
+    return None
+  return PHOTO_WIDTHS[img_size]
+
+def photo_manifest(post):
+  """Find every size of every photo in a photo post.
+  
+  :param Element post: A <post> element of type photo
+  :returns: A tuple with a (variants, caption) pair for each photo, where
+    variants is a tuple of (max-width, url) pairs, largest first
+  """
+  if post.find('photoset') is not None:
+    photos = post.find('photoset').getiterator('photo')
+  else:
+    photos = [post]
+  
+  manifest = []
+  for photo in photos:
+    variants = [(int(url.attrib.get('max-width', 0)), _intern(url.text))
+                for url in photo.findall('photo-url')]
+    variants.sort(key=lambda variant: variant[0], reverse=True)
+    caption = photo.find('photo-caption')
+    if caption is not None:
+      caption = caption.text
+    manifest.append((tuple(variants), caption))
+  return tuple(manifest)
+
+def pick_photo(variants,width=None):
+  """The URL of the largest variant that is at most width wide.
+  
+  If width is None, the largest variant is picked; if every variant is
+  too wide, the smallest one is.
+  """
+  for max_width, url in variants:
+    if width is None or max_width <= width:
+      return url
+  return variants[-1][1]
+
+def photos_html(photos,width=None):
+  """Render the photos in a manifest, with their captions."""
+  html = StringIO()
+  for variants, caption in photos:
+    html.write('<img src="%s" /><br />' % pick_photo(variants, width))
+    if caption is not None:
+      html.write(caption)
+  return html.getvalue()
+
+def resize(item,width):
+  """Make a photo post's entry again with images at most width wide.
+  
+  :param Entry item: A rendered entry
+  :param int width: Largest photo width to use; None means the largest photos
+  :returns: A resized copy of item if it has photos, otherwise item itself
+  """
+  if getattr(item, 'photos', None) is None:
+    return item
+  resized = Post(*[getattr(item, key) for key in Post._fields])
+  resized.content = photos_html(item.photos, width) + item.extra
+  return resized
+
+def post_date(post):
+  """When a post was posted, as a struct_time."""
+  return time.strptime(post.attrib.get('date-gmt'),"%Y-%m-%d %H:%M:%S %Z") #2011-09-12 00:33:28 GMT
+
+def render_post(post,img_size=0):
+  """Render one post into a feed item.
+  
+  :param Element post: A <post> element from the Tumblr XML
+  :param int img_size: Size of images to include; 0-5 (0 is original, 5 is small)
+  :returns: A Post
+  """
+  item = Post()
+  item.id = post.attrib.get('url-with-slug')
+  item.link = Link(item.id, 'alternate', 'text/html')
+  date = post_date(post)
+  item.published = date
+  item.updated = date
+  author = post.find('tumblelog')
+  shortname = _intern(author.attrib.get('name'))
+  item.author = Person(name=_intern(author.attrib.get('title')+" ("+shortname+")"),
+                       uri=_intern(author.attrib.get('url')))
+  posttype = _intern(post.attrib.get('type'))
+  
+  # Make the summary, based on type
+  if posttype == "regular":
+    item.summary = shortname+" posted on Tumblr"
+  elif posttype == "answer":
+    item.summary = shortname+" posted an "+posttype
+  elif posttype == "audio":
+    item.summary = shortname+" posted "+posttype
+  else:
+    item.summary = shortname+" posted a "+posttype
+  item.summary = _intern(item.summary)
+  
+  # Get title and content based on type
+  content = StringIO()
+  #### regular ####
+  if posttype == "regular":
+    if post.find('regular-title') is None:
+      item.title = item.summary
+    else:
+      item.title = post.find('regular-title').text
+    
+    if post.find('regular-body') is None:
+      content.write(item.title)
+      item.title = item.summary
+    else:
+      content.write(post.find('regular-body').text)
+  #### link ####
+  elif posttype == "link":
+    item.title = item.summary
+    
+    if post.find('link-title') is None:
+      title = post.find('link-url').text
+    else:
+      title = post.find('link-text').text
+    
+    if post.find('link-description') is None:
+      description = "<p>(No description)</p>"
+    else:
+      description = post.find('link-description').text
+    
+    content.write('<a href="%(url)s">%(title)s</a>:%(description)s' % \
+                  {'url':post.find('link-url').text,
+                   'title':title,
+                   'description':description})
+  #### quote  ####
+  elif posttype == "quote":
+    item.title = item.summary
+    
+    if post.find('quote-source') is None:
+      source = ""
+    else:
+      source = "<p>&mdash;"+post.find('quote-source').text+"</p>"
+    
+    content.write('<p>%(text)s</p>%(source)s' % \
+                  {'text': post.find('quote-text').text,
+                   'source': source})
+  #### photo  ####
+  elif posttype == "photo":
+    item.title = item.summary
+    
+    item.photos = photo_manifest(post)
+    photos = photos_html(item.photos, img_width(img_size))
+    content.write(photos)
+  #### conversation ####
+  elif posttype == "conversation":
+    if post.find('conversation-title') is not None:
+      item.title = post.find('conversation-title').text
+    else:
+      item.title = item.summary
+    
+    for line in post.find('conversation').getiterator('line'):
+      content.write("<p><strong>%(label)s</strong> %(text)s" % \
+                    {'label': line.attrib.get('label'),
+                     'text': line.text})
+  #### video ####
+  elif posttype == "video":
+    item.title = item.summary
+    
+    if post.find('video-caption') is not None:
+      caption = post.find('video-caption').text
+    else:
+      caption = ""
+    
+    content.write("%(player)s%(caption)s" % \
+                  {'player': post.find('video-player').text,
+                   'caption': caption})
+  #### audio ####
+  elif posttype == "audio":
+    item.title = item.summary
+    
+    if post.find('audio-caption') is not None:
+      caption = post.find('audio-caption').text
+    else:
+      caption = ""
+    
+    content.write("%(player)s%(caption)s" % \
+                  {'player': post.find('audio-player').text,
+                   'caption': caption})
+  #### answer ####
+  elif posttype == "answer":
+    item.title = item.summary
+    
+    content.write(
+      "<p><strong>Question</strong></p><p>%(question)s</p><p><strong>Answer</strong></p>%(answer)s" % \
+      {'question': post.find('question').text,
+       'answer': post.find('answer').text})
+  
+  # Get reblog information, since that's, you know, kind of important
+  if post.attrib.has_key('reblogged-from-name'):
+    content.write('<p><em>reblogged from <a href="%(url)s">%(name)s</a></em></p>' % \
+                  {'url': post.attrib.get('reblogged-from-url'),
+                   'name': post.attrib.get('reblogged-from-name')})
+  
+  # Get tag information
+  if post.find('tag') is not None:
+    url = post.find('tumblelog').attrib.get('url')
+    content.write('<p><strong>Tags:</strong>')
+    for tag in post.getiterator('tag'):
+      text = tag.text
+      content.write(' <a href="%(tagurl)s">#%(text)s</a>' % \
+                    {'tagurl': url+'tagged/'+text,
+                     'text': text})
+    content.write('</p>')
+  
+  item.content = content.getvalue()
+  content.close()
+  if item.photos is not None:
+    # Everything after the photos, for resize
+    item.extra = item.content[len(photos):]
+  return item
+
+def add_rebloggers(item,key,names,published):
+  """Make a rendered post stand for every copy of its root post.
+  
+  The entry gets the reblog key's id, so it is the same entry as each new
+  reblog comes in; only its updated date (and content) change. The other
+  reblogs are credited in its content.
+  
+  :param Entry item: The rendered entry, from the first copy in names
+  :param string key: The posts' reblog_key
+  :param list names: The reblogger of each copy of the root post, in the
+    same order as the copies; None for the root post itself
+  :param struct_time published: When the oldest copy was posted
+  """
+  item.id = reblog_id(key)
+  item.published = min(item.published, published)
+  others = [name for name in names[1:] if name is not None]
+  if others:
+    credits = '<p><em>also reblogged by %s</em></p>' % \
+      ', '.join(['<a href="%s">%s</a>' % (url, name) for name, url in others])
+    item.content += credits
+    if getattr(item, 'photos', None) is not None:
+      item.extra += credits
+
+def iter_entries(posts,img_size=0,collapse_reblogs=False):
+  """Render posts into feed entries lazily, as they are asked for.
+  
+  :param posts: Iterable of <post> elements, most recent first
+  :param int img_size: Size of images to include; 0-5 (0 is original, 5 is small)
+  :param bool collapse_reblogs: Merge reblogs of the same root post into one entry
+  :returns: A generator of Posts
+  """
+  if not collapse_reblogs:
+    for post in posts:
+      yield render_post(post, img_size)
+    return
+  
+  # Later reblogs are credited in the first one's entry, so find everyone
+  # who reblogged each root post before rendering anything
+  posts = list(posts)
+  keys = [reblog_key(post) for post in posts]
+  rebloggers = {}
+  oldest = {}
+  for post, key in zip(posts, keys):
+    if key is not None:
+      rebloggers.setdefault(key, []).append(reblogger(post))
+      oldest[key] = post
+  
+  # Only the first (most recent) copy of a reblogged post gets rendered
+  done = set()
+  for post, key in zip(posts, keys):
+    if key in done:
+      continue
+    item = render_post(post, img_size)
+    if key is not None:
+      done.add(key)
+      add_rebloggers(item, key, rebloggers[key], post_date(oldest[key]))
+    yield item
+
+def render_posts(posts,img_size=0,collapse_reblogs=False):
+  """Render posts into feed entries.
+  
+  :param list posts: <post> elements, most recent first
+  :param int img_size: Size of images to include; 0-5 (0 is original, 5 is small)
+  :param bool collapse_reblogs: Merge reblogs of the same root post into one entry
+  :returns: A list of Posts
+  """
+  return list(iter_entries(posts, img_size, collapse_reblogs))
+
+def collapse_rendered(rendered):
+  """Merge already rendered reblogs of the same root post into one entry.
+  
+  Like render_posts with collapse_reblogs, but for posts that were rendered
+  separately, e.g. from different dumps.
+  
+  :param list rendered: (item, reblog key, reblogger) tuples, most recent
+    first; the reblogger is None for posts that aren't reblogs
+  :returns: A list of Posts
+  """
+  items = []
+  rebloggers = {}
+  published = {}
+  collapsed = []
+  
+  for item, key, name in rendered:
+    if key is not None:
+      if rebloggers.has_key(key):
+        rebloggers[key].append(name)
+        published[key] = min(published[key], item.published)
+        continue
+      rebloggers[key] = [name]
+      published[key] = item.published
+      collapsed.append((item, key))
+    items.append(item)
+  
+  for item, key in collapsed:
+    add_rebloggers(item, key, rebloggers[key], published[key])
+  return items
+
+def make_feed(feedtitle,feeddescription,feedurl,authoremail,hub=None):
+  """Set up an Atom feed with no entries yet.
+  
+  :param string feedtitle: Title of the atom feed
+  :param string feeddescription: Description of the atom feed
+  :param string feedurl: URL that will contain the feed
+  :param string authoremail: Email address of the dashboard's owner
+  :param string hub: URL of a WebSub hub to advertise in the feed, if any
+  :returns: A feedformatter Feed
+  """
+  feedurl = feed_url(feedurl)
+  
+  atom = Feed()
+  atom.feed["title"] = feedtitle
+  atom.feed["description"] = feeddescription
+  atom.feed["id"] = feedurl
+  atom.feed["link"] = {'_href': feedurl,
+                       '_rel': 'self',
+                       '_type': 'application/atom+xml'}
+  atom.feed["generator"] = {'_uri': "http://github.com/tbekolay/Tumblr-Dashboard-Feed",
+                            '_version': '0.1',
+                            'text': 'Tumblr Dashboard Reader'}
+  atom.feed["icon"] = "http://assets.tumblr.com/images/favicon.gif"
+  atom.feed["logo"] = "http://assets.tumblr.com/images/logo.png"
+  atom.feed["author"] = {'name':authoremail.split('@')[0], 'email':authoremail}
+  atom.feed["updated"] = time.gmtime()
+  if hub:
+    atom.feed["hub"] = hub
+  return atom
+
+def entries_to_atom(entries,feedtitle,feeddescription,feedurl,authoremail,
+                    hub=None,entry_cache=None,limit=None,fields=None,width=None):
+  """Make an Atom feed from already rendered entries.
+  
+  :param entries: Iterable of Posts, most recent first
+  :param string feedtitle: Title of the atom feed
+  :param string feeddescription: Description of the atom feed
+  :param string feedurl: URL that will contain the feed
+  :param string authoremail: Email address of the dashboard's owner
+  :param string hub: URL of a WebSub hub to advertise in the feed, if any
+  :param dict entry_cache: Serialized entries from the previous run, which
+    is updated in place (see Feed.format_atom_string)
+  :param int limit: Most entries to include; later ones aren't taken from entries
+  :param tuple fields: Names of the entry elements to include (see
+    Feed.format_atom_string); all of them by default
+  :param int width: Largest photo width, from the photo manifests; if None,
+    photos are left as they were rendered
+  :returns: The Atom feed's XML
+  """
+  atom = make_feed(feedtitle,feeddescription,feedurl,authoremail,hub)
+  if width is not None:
+    entries = (resize(entry, width) for entry in entries)
+  atom.entries = entries
+  return atom.format_atom_string(pretty=True, entry_cache=entry_cache,
+                                 limit=limit, fields=fields)
+
+def xml_to_atom(xml,feedtitle,feeddescription,feedurl,authoremail,img_size=0,
+                collapse_reblogs=False,hub=None,entry_cache=None,
+                limit=None,fields=None,width=None):
+  """Transform the XML from Tumblr into an Atom feed.
+  
+  :param string xml: Raw XML returned from Tumblr
+  :param string feedtitle: Title of the atom feed
+  :param string feeddescription: Description of the atom feed
+  :param string feedurl: URL that will contain the feed
+  :param int img_size: Size of images to include; 0-5 (0 is original, 5 is small)
+  :param bool collapse_reblogs: Merge reblogs of the same root post into one entry
+  :param string hub: URL of a WebSub hub to advertise in the feed, if any
+  :param dict entry_cache: Serialized entries from the previous run, which
+    is updated in place (see Feed.format_atom_string)
+  :param int limit: Most entries to include; later posts aren't parsed or rendered
+  :param tuple fields: Names of the entry elements to include (see
+    Feed.format_atom_string); all of them by default
+  :param int width: Largest photo width, overriding img_size
+  :returns: The Atom feed's XML
+  """
+  # Make sure parameters are "good"
+  if type(img_size) is not int:
+    img_size = int(img_size)
+  
+  return entries_to_atom(iter_entries(iter_posts(xml),img_size,collapse_reblogs),
+                         feedtitle,feeddescription,feedurl,authoremail,hub,
+                         entry_cache,limit,fields,width)
@@ -56,6 +56,8 @@ except ImportError:
     feedformatterCanPrettyPrint = False
 
 from time import time, strftime, strptime, localtime, mktime, struct_time, timezone
+from hashlib import md5
+from itertools import islice
 import datetime
 import types
 
@@ -105,6 +107,7 @@ _atom_feed_mappings = (
     (("title",), "title"),
     (("id", "link", "url"), "id", lambda(x): _atomise_id(x)),
     (("link", "url"), "link", lambda(x):_atomise_link(x, rel='self')),
+    (("hub",), "link", lambda(x): _atomise_hub(x)),
     (("description", "desc", "summary"), "subtitle"),
     (("pubDate", "pubdate", "date", "published", "updated"), "updated", lambda(x): _format_datetime("atom",x)),
     (("category",), "category"),
@@ -199,11 +202,17 @@ def _atomise_id(link):
 
     if type(link) is dict:
         return link['_href']
+    elif isinstance(link, Link):
+        return link.href
     return link
 
 def _atomise_link(link, rel=None):
 
-    if type(link) is dict:
+    if isinstance(link, Link):
+        if rel and link.rel is None:
+            return Link(link.href, rel, link.type)
+        return link
+    elif type(link) is dict:
         if '_type' not in link:
             link['_type'] = 'text/html'
         if rel and '_rel' not in link:
@@ -214,6 +223,19 @@ def _atomise_link(link, rel=None):
             return {'_href' : link, '_type': 'text/html', '_rel': rel}
         return {'_href' : link, '_type': 'text/html'}
 
+def _atomise_hub(hub):
+
+    """
+    Convert hub into the link advertising a WebSub hub for the feed.
+    """
+
+    if type(hub) is dict:
+        hub['_rel'] = 'hub'
+        return hub
+    elif isinstance(hub, Link):
+        return Link(hub.href, 'hub', hub.type)
+    return {'_href' : hub, '_rel' : 'hub'}
+
 def _atomise_person(person):
 
     """
@@ -221,7 +243,7 @@ def _atomise_person(person):
     atom:Person construct.
     """
 
-    if type(person) is dict:
+    if type(person) is dict or isinstance(person, Person):
         return person
     else:
         if person.startswith("http://") or person.startswith("www"):
@@ -246,6 +268,8 @@ def _rssify_author(author):
             return author["email"]
         except KeyError:
             return None
+    elif isinstance(author, Person):
+        return author.email
     else:
         if "@" in author and "." in author:
             # Probably an email address
@@ -257,6 +281,8 @@ def _rssify_link(link):
 
     if type(link) is dict:
         return link['href']
+    elif isinstance(link, Link):
+        return link.href
     else:
         return link
 
@@ -298,7 +324,19 @@ def _add_subelem(root_element, name, value):
     if value is None:
         return
     
-    if type(value) is dict:
+    if isinstance(value, Record):
+        # Records say which of their fields are attributes; the rest
+        # are subelements.  Unlike dicts, they are left as they were.
+        attribs = {}
+        for key in value._attribs:
+            attrib = getattr(value, key)
+            if attrib is not None:
+                attribs[key] = attrib
+        subElem = ET.SubElement(root_element, name, attribs)
+        for key in value._children:
+            _add_subelem(subElem, key, getattr(value, key))
+    
+    elif type(value) is dict:
         if name == 'content':
             # A wee hack, the content node must be 
             # converted to a CDATA block. This is a sort of cheat, see:
@@ -363,6 +401,126 @@ def _elementToString(element, encoding="UTF-8"):
     ElementTreeCDATA(element).write(file, encoding)
     return ''.join(data)
 
+def _fragmentToString(element, encoding="UTF-8"):
+    """
+    Like _elementToString, but without an XML declaration,
+    so that the result can be spliced into a larger document
+    """
+
+    class dummy:
+        pass
+    data = []
+    file = dummy()
+    file.write = data.append
+    ElementTreeCDATA(element)._write(file, element, encoding, {})
+    return ''.join(data)
+
+def _entry_cache_key(entry):
+
+    """
+    Return the (id, version) key under which entry's serialized XML is
+    kept in an entry cache.  Entries may supply their own "version";
+    otherwise it is a hash of everything in the entry.
+    """
+
+    entry_id = None
+    for key in ("id", "link", "url"):
+        if key in entry:
+            entry_id = _atomise_id(entry[key])
+            break
+    if "version" in entry:
+        return (entry_id, entry["version"])
+    items = entry.items()
+    items.sort()
+    return (entry_id, md5(repr(items)).hexdigest())
+
+### RECORDS ------------------------------
+
+class Record(object):
+
+    """
+    Base class for compact, fixed-field alternatives to the dictionaries
+    that describe feeds, entries, links and people.  Fields that are None
+    are treated as missing, and records can be read like dictionaries, so
+    the mappings above work on either.  _fields lists every field,
+    including those from base classes, since __slots__ only lists a
+    class's own.
+    """
+
+    __slots__ = ()
+    _fields = ()
+    _attribs = ()
+    _children = ()
+
+    def __init__(self, *args, **kwargs):
+        for key, value in zip(self._fields, args):
+            setattr(self, key, value)
+        for key in self._fields[len(args):]:
+            setattr(self, key, kwargs.pop(key, None))
+        if kwargs:
+            raise TypeError("%s has no field %s" %
+                (self.__class__.__name__, kwargs.keys()[0]))
+
+    def __contains__(self, key):
+        return key in self._fields and getattr(self, key) is not None
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        return getattr(self, key)
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self._fields
+                if getattr(self, key) is not None]
+
+    # Records are pickled as {field: value}, so pickles stay readable when
+    # fields are added or removed: new fields start as None, and the values
+    # of fields that are gone are dropped.
+    def __getstate__(self):
+        return dict([(key, getattr(self, key)) for key in self._fields])
+
+    def __setstate__(self, state):
+        if isinstance(state, tuple):
+            # Pickled positionally, before the switch to dicts; only safe
+            # while the fields are the ones it was written with
+            if len(state) != len(self._fields):
+                raise ValueError("%s pickled with %d fields, now has %d" %
+                    (self.__class__.__name__, len(state), len(self._fields)))
+            state = dict(zip(self._fields, state))
+        for key in self._fields:
+            setattr(self, key, state.get(key))
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__,
+            ", ".join(["%s=%r" % item for item in self.items()]))
+
+class Link(Record):
+
+    """An atom:link; all of its fields are attributes."""
+
+    __slots__ = ("href", "rel", "type")
+    _fields = _attribs = __slots__
+
+class Person(Record):
+
+    """An atom:Person construct; all of its fields are subelements."""
+
+    __slots__ = ("name", "email", "uri")
+    _fields = _children = __slots__
+
+class Entry(Record):
+
+    """A feed item or entry.  version, if given, is used by entry caches."""
+
+    __slots__ = ("id", "title", "link", "summary", "content",
+                 "published", "updated", "author", "version")
+    _fields = __slots__
+
 class Feed:
 
     ### INTERNAL METHODS ------------------------------
@@ -509,24 +667,82 @@ class Feed:
                     "least one author element in the feed element or at least "
                     " one author element in each entry element")
 
-    def format_atom_string(self, validate=True, pretty=False):
-
-        """Format the feed as Atom 1.0 and return the result as a string."""
-
-        if validate:
-            self.validate_atom()
+    def _atom_entries(self, validate=True, limit=None):
+
+        """Yield at most limit entries, checking each one as it comes if
+        validate.  Entries may be any iterable, so that they can be
+        rendered lazily; only as many as are needed are taken from it."""
+
+        entries = self.entries
+        if limit is not None:
+            entries = islice(entries, limit)
+        for entry in entries:
+            # The same check as validate_atom, one entry at a time
+            if validate and "author" not in self.feed and "author" not in entry:
+                raise InvalidFeedException("Atom feeds must have either at "
+                "least one author element in the feed element or at least "
+                " one author element in each entry element")
+            yield entry
+
+    def format_atom_string(self, validate=True, pretty=False, entry_cache=None,
+                           limit=None, fields=None):
+
+        """Format the feed as Atom 1.0 and return the result as a string.
+
+        If entry_cache is a dictionary, entries whose serialized XML is
+        already in it are spliced in as is, and only new or changed entries
+        are serialized.  On return, entry_cache holds exactly the entries
+        of this feed, ready to be passed in again next time.
+
+        If limit is given, only the first limit entries are formatted.  If
+        fields is given, entries only get the subelements named in it
+        (plus id, title and updated, which Atom requires); the entry cache
+        is not used for such partial entries."""
+
+        entries = self._atom_entries(validate, limit)
+        mappings = _atom_item_mappings
+        if fields is not None:
+            fields = ("id", "title", "updated") + tuple(fields)
+            mappings = [mapping for mapping in mappings if mapping[1] in fields]
+            entry_cache = None
         AtomRoot = ET.Element( 'feed', {"xmlns":"http://www.w3.org/2005/Atom"} )
         _add_subelems(AtomRoot, _atom_feed_mappings, self.feed)
-        for entry in self.entries:
-            AtomItem = ET.SubElement ( AtomRoot, 'entry' )
-            _add_subelems(AtomItem, _atom_item_mappings, entry)
-        return _stringify(AtomRoot, pretty=pretty)
-
-    def format_atom_file(self, filename, validate=True, pretty=False):
+        if entry_cache is None or (pretty and feedformatterCanPrettyPrint):
+            # Pretty printing reflows the whole document, so can't splice
+            for entry in entries:
+                AtomItem = ET.SubElement ( AtomRoot, 'entry' )
+                _add_subelems(AtomItem, mappings, entry)
+            return _stringify(AtomRoot, pretty=pretty)
+
+        header = _elementToString(AtomRoot)
+        if header.endswith(" />"):
+            head, tail = header[:-3] + ">", "</feed>"
+        else:
+            end = header.rindex("</feed>")
+            head, tail = header[:end], header[end:]
+        fragments = [head]
+        fresh = {}
+        for entry in entries:
+            key = _entry_cache_key(entry)
+            fragment = entry_cache.get(key)
+            if fragment is None:
+                AtomItem = ET.Element('entry')
+                _add_subelems(AtomItem, _atom_item_mappings, entry)
+                fragment = _fragmentToString(AtomItem)
+            fresh[key] = fragment
+            fragments.append(fragment)
+        fragments.append(tail)
+        entry_cache.clear()
+        entry_cache.update(fresh)
+        return ''.join(fragments)
+
+    def format_atom_file(self, filename, validate=True, pretty=False,
+                         limit=None, fields=None):
 
         """Format the feed as Atom 1.0 and save the result to a file."""
 
-        string = self.format_atom_string(validate, pretty)
+        string = self.format_atom_string(validate, pretty, limit=limit,
+                                         fields=fields)
         fp = open(filename, "w")
         fp.write(string)
         fp.close()
@@ -0,0 +1,173 @@
+"""Datastore models for dashboards and their posts."""
+import random
+import datetime
+
+from google.appengine.ext import db
+
+# Dashboard XML and feeds are split into shards of at most this many bytes
+SHARD_SIZE = 512 * 1024
+# Datastore puts are limited to this many entities at a time
+PUT_BATCH = 500
+# Keep each batched put well under the API's request size limit
+PUT_BATCH_BYTES = 4 * 1024 * 1024
+
+class TumblrDashboard(db.Model):
+  """Models a TumblrDashboard entry with email identifier, raw XML, and Atom feed.
+
+  The entry itself is a small version record. The XML, the feed and the
+  pickled feed entries ("xml", "atom" and "entries" documents) are kept in
+  TumblrDashboardShard children, listed in shards, so readers fetch only
+  the document they need. Entries stored before sharding keep their XML
+  and feed inline in xml and atom.
+
+  The shards of the documents replaced by the last write are listed in
+  retired, and are only deleted by the write after it, so a reader that
+  got the record just before a write can still read the version it saw.
+  entry_ids lists the ids of the entries in the current feed.
+  """
+  # key = email
+  xml = db.TextProperty()
+  atom = db.TextProperty()
+  version = db.IntegerProperty(default=0)
+  shards = db.StringListProperty(indexed=False)
+  retired = db.StringListProperty(indexed=False)
+  entry_ids = db.StringListProperty(indexed=False)
+
+  def shard_keys(self,name):
+    """Keys of the shards holding the named document, in order."""
+    prefix = name+'.'
+    return [db.Key.from_path('TumblrDashboardShard', key_name, parent=self.key())
+            for key_name in self.shards if key_name.startswith(prefix)]
+
+class TumblrDashboardShard(db.Model):
+  """One piece of a dashboard's XML, Atom feed or entries."""
+  # parent = TumblrDashboard, key = <document>.<version>.<token>.<index>
+  data = db.BlobProperty()
+
+class TumblrPost(db.Model):
+  """Models one rendered dashboard post, as archived by tools/backfill.py."""
+  # parent = TumblrDashboard, key = post URL
+  published = db.DateTimeProperty()
+  reblog_key = db.StringProperty()
+  item = db.BlobProperty()
+
+  @classmethod
+  def from_item(cls,dash,item,reblog_key=None):
+    """Make a TumblrPost from a rendered feed item.
+
+    :param TumblrDashboard dash: The dashboard the post appeared on
+    :param Entry item: A feed entry, as made by dashboard.render_post
+    :param string reblog_key: The item's dashboard.reblog_key, if any
+    """
+    import cPickle as pickle
+    return cls(parent=dash, key_name=item.id,
+               published=datetime.datetime(*item.published[:6]),
+               reblog_key=reblog_key,
+               item=db.Blob(pickle.dumps(item, pickle.HIGHEST_PROTOCOL)))
+
+  def to_item(self):
+    import cPickle as pickle
+    return pickle.loads(self.item)
+
+def get_dashboards(emails):
+  """Get the dashboards for many accounts with one batch get.
+
+  Accounts that have no dashboard yet get a new, unsaved one.
+
+  :param list emails: Tumblr account email addresses
+  :returns: A list of TumblrDashboards, in the same order
+  """
+  keys = [db.Key.from_path('TumblrDashboard', email) for email in emails]
+  return [dash or TumblrDashboard(key_name=email)
+          for email, dash in zip(emails, db.get(keys))]
+
+def load_documents(dashes,name,binary=False):
+  """Read one document from each of many dashboards with one batch get.
+
+  :param list dashes: TumblrDashboards
+  :param string name: "xml", "atom" or "entries"
+  :param bool binary: Return the documents' bytes instead of decoding them
+  :returns: A list of the documents, as unicode (or str if binary), or
+    None where missing
+  """
+  keys = []
+  for dash in dashes:
+    keys.extend(dash.shard_keys(name))
+  shards = {}
+  if keys:
+    for key, shard in zip(keys, db.get(keys)):
+      shards[key] = shard
+
+  documents = []
+  for dash in dashes:
+    dash_keys = dash.shard_keys(name)
+    if not dash_keys:
+      # Stored before sharding, or never stored
+      documents.append(getattr(dash, name, None))
+    elif None in [shards[key] for key in dash_keys]:
+      documents.append(None)
+    else:
+      data = ''.join([shards[key].data for key in dash_keys])
+      documents.append(binary and data or data.decode('utf-8'))
+  return documents
+
+def _put_batches(entities):
+  """Put entities in as few calls as the batch limits allow."""
+  batch = []
+  size = 0
+  for entity in entities:
+    length = isinstance(entity, TumblrDashboardShard) and len(entity.data) or 0
+    if batch and (len(batch) == PUT_BATCH or size + length > PUT_BATCH_BYTES):
+      db.put(batch)
+      batch = []
+      size = 0
+    batch.append(entity)
+    size += length
+  if batch:
+    db.put(batch)
+
+def store_documents(updates):
+  """Write new documents for many dashboards with a few batched calls.
+
+  Each document is split into shards of at most SHARD_SIZE bytes under a
+  new version. The version is read without a transaction, so two updates
+  running at once can pick the same one; a random token in the shards'
+  key names keeps their shards apart, and whichever record is put last
+  lists only its own. All the new shards are put before any of the version
+  records that point at them. The replaced shards are kept until the
+  next write, which deletes them after putting its own records, so a
+  reader that got the previous record still finds a complete document.
+
+  :param list updates: (TumblrDashboard, {name: text}) pairs, where each
+    name is "xml", "atom" or "entries"
+  """
+  shards = []
+  stale = []
+  for dash, documents in updates:
+    dash.version = (dash.version or 0) + 1
+    token = '%08x' % random.getrandbits(32)
+    stale.extend([db.Key.from_path('TumblrDashboardShard', key_name, parent=dash.key())
+                  for key_name in dash.retired])
+    dash.retired = []
+    for name, text in documents.items():
+      prefix = name+'.'
+      dash.retired.extend([key_name for key_name in dash.shards
+                           if key_name.startswith(prefix)])
+      dash.shards = [key_name for key_name in dash.shards
+                     if not key_name.startswith(prefix)]
+      # Documents are only kept in shards from now on
+      if name in dash.properties():
+        setattr(dash, name, None)
+
+      if isinstance(text, unicode):
+        text = text.encode('utf-8')
+      for index, start in enumerate(range(0, max(len(text), 1), SHARD_SIZE)):
+        key_name = '%s%d.%s.%d' % (prefix, dash.version, token, index)
+        dash.shards.append(key_name)
+        shards.append(TumblrDashboardShard(parent=dash, key_name=key_name,
+                                           data=db.Blob(text[start:start+SHARD_SIZE])))
+
+  _put_batches(shards)
+  _put_batches([dash for dash, documents in updates])
+  for start in range(0, len(stale), PUT_BATCH):
+    db.delete(stale[start:start+PUT_BATCH])
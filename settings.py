@@ -0,0 +1,160 @@
+"""Account and feed settings, from config.ini or a precompiled snapshot of it.
+
+Parsing config.ini with RawConfigParser on every cold start costs more than
+importing a module of literals, so running
+
+  python settings.py
+
+checks config.ini and writes its accounts to config_snapshot.py. The snapshot
+is used as long as it was made from the config.ini next to it; otherwise (or
+if there is no snapshot) config.ini is parsed as before.
+"""
+import os
+import sys
+from hashlib import md5
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+CONFIG = os.path.join(ROOT, 'config.ini')
+SNAPSHOT = os.path.join(ROOT, 'config_snapshot.py')
+
+# Bump when the account dictionaries change, so old snapshots are ignored
+SNAPSHOT_FORMAT = 1
+
+_defaults = {
+  'tumblr': {
+             'email': 'example@example.com',
+             'password': 'example',
+            },
+  'feed': {
+           'title': 'My Dashboard Feed',
+           'description': 'My Tumblr Dashboard feed',
+           'img_size': 0,
+           'collapse_reblogs': 'false',
+           'hub': '',
+          },
+            }
+
+_accounts = None
+
+############
+# Parsing  #
+############
+def digest(path=CONFIG):
+  """MD5 of a config file's contents, or None if there is no such file."""
+  try:
+    config = open(path, 'rb')
+  except IOError:
+    return None
+  try:
+    return md5(config.read()).hexdigest()
+  finally:
+    config.close()
+
+def parse(path=CONFIG):
+  """Read the accounts to make feeds for from a config file.
+
+  The account in [tumblr] is served at /atom.xml. Each [tumblr <name>]
+  section adds another account, served at /<name>/atom.xml, which can
+  override any of the [feed] settings.
+
+  :param string path: The config file, which needs a [tumblr] section
+  :raises ConfigParser.NoSectionError: If there is no [tumblr] section,
+    which is also what happens if the file is missing
+  :returns: A list of dictionaries with the account's name (None for the
+    main account), email, password and feed settings
+  """
+  from ConfigParser import RawConfigParser
+
+  config = RawConfigParser(_defaults)
+  config.read(path)
+  sections = ['tumblr'] + sorted([section for section in config.sections()
+                                  if section.startswith('tumblr ')])
+  accounts = []
+  for section in sections:
+    account = {'name': section[len('tumblr '):] or None,
+               'email': config.get(section,'email'),
+               'password': config.get(section,'password')}
+    for option in ('title','description','url','img_size','collapse_reblogs','hub'):
+      if config.has_option(section,option):
+        account[option] = config.get(section,option)
+      elif config.has_option('feed',option):
+        account[option] = config.get('feed',option)
+      else:
+        account[option] = _defaults['feed'].get(option)
+    account['img_size'] = int(account['img_size'])
+    account['collapse_reblogs'] = str(account['collapse_reblogs']).lower() in \
+                                  ('1','yes','true','on')
+    accounts.append(account)
+  return accounts
+
+def validate(accounts):
+  """Check parsed accounts for settings that would only fail later.
+
+  :raises ValueError: Describing the first problem found
+  """
+  names = {}
+  for account in accounts:
+    section = account['name'] and 'tumblr '+account['name'] or 'tumblr'
+    if not account['email'] or not account['password']:
+      raise ValueError("[%s] needs an email and a password" % section)
+    if not account.get('url'):
+      raise ValueError("[%s] has no url, in it or in [feed]" % section)
+    if account['hub'] and account['hub'].split('://')[0] not in ('http', 'https'):
+      raise ValueError("[%s] hub must be an http(s) URL, not %r" % (section, account['hub']))
+    if not 0 <= account['img_size'] <= 5:
+      raise ValueError("[%s] img_size must be 0-5, not %d" % (section, account['img_size']))
+    name = (account['name'] or '').lower()
+    if names.has_key(name):
+      raise ValueError("[%s] and [%s] are served at the same URL" % (names[name], section))
+    names[name] = section
+
+#############
+# Snapshots #
+#############
+def write_snapshot(path=CONFIG, snapshot=SNAPSHOT):
+  """Parse and validate a config file, and save its accounts as a module.
+
+  :returns: The accounts
+  """
+  accounts = parse(path)
+  validate(accounts)
+  out = open(snapshot, 'w')
+  try:
+    out.write('# Generated from config.ini by settings.py; do not edit.\n')
+    out.write('FORMAT = %r\n' % SNAPSHOT_FORMAT)
+    out.write('DIGEST = %r\n' % digest(path))
+    out.write('ACCOUNTS = %r\n' % (accounts,))
+  finally:
+    out.close()
+  return accounts
+
+def load(path=CONFIG):
+  """The accounts from the snapshot if it matches path, otherwise from path."""
+  if path == CONFIG:
+    try:
+      import config_snapshot
+    except ImportError:
+      pass
+    else:
+      if getattr(config_snapshot, 'FORMAT', None) == SNAPSHOT_FORMAT and \
+         config_snapshot.DIGEST == digest(path):
+        return config_snapshot.ACCOUNTS
+  return parse(path)
+
+def accounts():
+  """The accounts to make feeds for; see parse.
+
+  They are loaded on the first call and kept for the life of the instance.
+  """
+  global _accounts
+  if _accounts is None:
+    _accounts = load()
+  return _accounts
+
+if __name__ == '__main__':
+  try:
+    written = write_snapshot(*sys.argv[1:2])
+  except ValueError, e:
+    sys.stderr.write('%s\n' % e)
+    sys.exit(1)
+  sys.stdout.write('wrote %s with %d account(s)\n' % (SNAPSHOT, len(written)))
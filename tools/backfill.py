@@ -0,0 +1,223 @@
+"""Rebuild feeds and the post archive from archived dashboard dumps.
+
+Each PATH is a dashboard XML file, a directory of them (searched
+recursively for *.xml), or a .tar, .tar.gz, .tgz, .tar.bz2 or .zip archive
+of them.  Dumps are parsed and rendered in a pool of worker processes, posts
+that appear in more than one dump are kept once, and the results are written
+through remote_api: every post as a TumblrPost, and the most recent window
+of posts as the account's feed.
+
+Needs the App Engine SDK on the path and remote_api enabled in app.yaml, e.g.
+
+  PYTHONPATH=/opt/google_appengine python tools/backfill.py \\
+    --server your-app-name.appspot.com dumps/ old-dumps.tar.gz
+"""
+import os
+import sys
+import time
+import cPickle as pickle
+import getpass
+import tarfile
+import zipfile
+import optparse
+import traceback
+import multiprocessing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import settings
+from dashboard import parse_posts, reblog_key, reblogger, render_post, \
+                      collapse_rendered, make_feed
+
+#########
+# Input #
+#########
+def iter_dumps(paths):
+  """Yield (name, xml) for every dump in paths, reading one at a time."""
+  for path in paths:
+    if os.path.isdir(path):
+      for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        for filename in sorted(filenames):
+          if filename.endswith('.xml'):
+            name = os.path.join(dirpath, filename)
+            yield name, open(name, 'rb').read()
+    elif zipfile.is_zipfile(path):
+      archive = zipfile.ZipFile(path)
+      for name in archive.namelist():
+        if name.endswith('.xml'):
+          yield '%s:%s' % (path, name), archive.read(name)
+      archive.close()
+    elif tarfile.is_tarfile(path):
+      # Stream mode reads members in order without seeking back
+      archive = tarfile.open(path, 'r|*')
+      for member in archive:
+        if member.isfile() and member.name.endswith('.xml'):
+          yield '%s:%s' % (path, member.name), archive.extractfile(member).read()
+      archive.close()
+    else:
+      yield path, open(path, 'rb').read()
+
+def batches(iterable, size):
+  batch = []
+  for thing in iterable:
+    batch.append(thing)
+    if len(batch) == size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+##############
+# Rendering  #
+##############
+def render_dump(task):
+  """Parse and render every post in one dump; runs in a worker process.
+
+  :param tuple task: (name, xml, img_size)
+  :returns: (name, newest post date, [(id, item, reblog key, reblogger), ...], error)
+  """
+  name, xml, img_size = task
+  try:
+    rendered = []
+    newest = None
+    for post in parse_posts(xml):
+      item = render_post(post, img_size)
+      rendered.append((item.id, item, reblog_key(post), reblogger(post)))
+      if newest is None or item.published > newest:
+        newest = item.published
+    return name, newest, rendered, None
+  except Exception:
+    return name, None, [], traceback.format_exc()
+
+def merge(results, merged, latest):
+  """Fold the results for some dumps into the posts merged so far.
+
+  When a post is in several dumps, the copy from the most recent dump wins.
+
+  :param dict merged: Post id -> (dump date, item, reblog key, reblogger)
+  :param list latest: [dump date, xml] of the most recent dump, updated in place
+  :returns: Number of posts that were already merged
+  """
+  duplicates = 0
+  for name, newest, rendered, xml in results:
+    if newest is not None and (latest[0] is None or newest > latest[0]):
+      latest[0], latest[1] = newest, xml
+    for post_id, item, key, who in rendered:
+      if merged.has_key(post_id):
+        duplicates += 1
+        if merged[post_id][0] >= newest:
+          continue
+      merged[post_id] = (newest, item, key, who)
+  return duplicates
+
+##########
+# Output #
+##########
+def connect(server, app_id):
+  """Point the datastore API at a deployed app through remote_api."""
+  from google.appengine.ext.remote_api import remote_api_stub
+
+  def auth():
+    return raw_input('Email: '), getpass.getpass('Password: ')
+  remote_api_stub.ConfigureRemoteApi(app_id, '/_ah/remote_api', auth, server)
+
+def app_id_from_yaml():
+  for line in open(os.path.join(ROOT, 'app.yaml')):
+    if line.startswith('application:'):
+      return line.split(':', 1)[1].strip()
+
+def write(account, merged, latest, window):
+  """Store the merged posts and rebuild the account's feed from them."""
+  from google.appengine.ext import db
+  from models import PUT_BATCH, TumblrPost, get_dashboards, store_documents
+
+  posts = merged.values()
+  posts.sort(key=lambda post: post[1]["published"], reverse=True)
+
+  dash = get_dashboards([account['email']])[0]
+  if not dash.is_saved():
+    dash.put()
+  for batch in batches(posts, PUT_BATCH):
+    db.put([TumblrPost.from_item(dash, item, key)
+            for newest, item, key, who in batch])
+
+  if account['collapse_reblogs']:
+    items = collapse_rendered([(item, key, who) for newest, item, key, who in posts])
+  else:
+    items = [item for newest, item, key, who in posts]
+  atom = make_feed(account['title'], account['description'], account['url'],
+                   account['email'], account['hub'])
+  atom.items.extend(items[:window])
+  dash.entry_ids = [item.id for item in items[:window]]
+  documents = {'atom': atom.format_atom_string(pretty=True),
+               'entries': pickle.dumps(items[:window], pickle.HIGHEST_PROTOCOL)}
+  if latest[1] is not None:
+    documents['xml'] = latest[1]
+  store_documents([(dash, documents)])
+
+########
+# Main #
+########
+def main(argv=None):
+  parser = optparse.OptionParser(usage='%prog [options] PATH...')
+  parser.add_option('--server', help='host of the deployed app, e.g. app.appspot.com')
+  parser.add_option('--app-id', help='application id [from app.yaml]')
+  parser.add_option('--config', default=os.path.join(ROOT, 'config.ini'),
+                    help='config file with the account and feed settings [%default]')
+  parser.add_option('--account', metavar='NAME',
+                    help='the [tumblr NAME] account to backfill [the [tumblr] account]')
+  parser.add_option('--processes', type='int', default=multiprocessing.cpu_count(),
+                    help='worker processes [%default]')
+  parser.add_option('--window', type='int', default=50,
+                    help='posts to put in the rebuilt feed [%default]')
+  parser.add_option('--dry-run', action='store_true',
+                    help='parse and render, but write nothing')
+  options, paths = parser.parse_args(argv)
+  if not paths:
+    parser.error('no dumps given')
+  if not options.server and not options.dry_run:
+    parser.error('--server is needed, unless this is a --dry-run')
+
+  accounts = [account for account in settings.parse(options.config)
+              if account['name'] == options.account]
+  if not accounts:
+    parser.error('no [tumblr %s] account in %s' % (options.account, options.config))
+  account = accounts[0]
+
+  # Start the workers before remote_api opens any connections
+  pool = multiprocessing.Pool(options.processes)
+  merged = {}
+  latest = [None, None]
+  dumps = duplicates = 0
+  start = time.time()
+  try:
+    # Batches keep only a few dumps in memory while the workers run
+    for batch in batches(iter_dumps(paths), options.processes * 4):
+      tasks = [(name, xml, account['img_size']) for name, xml in batch]
+      results = []
+      for (name, newest, rendered, error), (_, xml) in \
+          zip(pool.map(render_dump, tasks), batch):
+        if error:
+          sys.stderr.write('skipping %s:\n%s' % (name, error))
+          continue
+        results.append((name, newest, rendered, xml))
+      dumps += len(results)
+      duplicates += merge(results, merged, latest)
+  finally:
+    pool.close()
+    pool.join()
+
+  sys.stdout.write('%d dumps, %d posts (%d duplicates) in %.1fs with %d processes\n' %
+                   (dumps, len(merged), duplicates, time.time() - start,
+                    options.processes))
+  if options.dry_run or not merged:
+    return
+
+  connect(options.server, options.app_id or app_id_from_yaml())
+  write(account, merged, latest, options.window)
+  sys.stdout.write('wrote %d posts and the feed for %s\n' % (len(merged), account['email']))
+
+if __name__ == '__main__':
+  main()
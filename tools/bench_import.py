@@ -0,0 +1,210 @@
+"""Benchmark how long a new instance takes to serve its first /atom.xml.
+
+Each run starts a fresh Python process, stores a feed in the datastore stub,
+and then times importing the app and handling the first request, noting
+which of the heavier modules were loaded on the way. Runs are repeated for
+each mode and the medians reported:
+
+  lazy         the app as it is
+  eager        the rendering and fetching modules imported and config.ini
+               parsed up front, as the app did before the read path was
+               split from the update path
+  no-snapshot  the app as it is, but parsing config.ini instead of using
+               config_snapshot.py
+
+The numbers are for the local SDK and stubs, and only useful for comparing
+modes with each other: they are not what a production instance sees. The
+31ms -> 10ms quoted when the read path was split was measured with stand-ins
+for the SDK modules, which understates the SDK's own import time.
+
+Needs the App Engine SDK on the path, e.g.
+
+  PYTHONPATH=/opt/google_appengine:/opt/google_appengine/lib/webob \\
+    python tools/bench_import.py --runs 20
+"""
+import imp
+import os
+import sys
+import time
+import optparse
+import tempfile
+import subprocess
+from StringIO import StringIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MODES = ('lazy', 'eager', 'no-snapshot')
+
+# What the app imported at the top before the split
+EAGER = ('cgi', 'httplib', 'random', 'socket', 'urllib', 'urlparse', 'pickle',
+         'wsgiref.handlers', 'google.appengine.api.users',
+         'google.appengine.api.memcache', 'google.appengine.api.taskqueue',
+         'dashboard')
+
+# Reported when a run loads them
+WATCHED = ('dashboard', 'feedformatter.feedformatter', 'ConfigParser',
+           'config_snapshot', 'httplib', 'cPickle', 'xml.etree.cElementTree')
+
+#########
+# Child #
+#########
+def _get(application, path):
+  """Call the WSGI application; returns the status code."""
+  environ = {
+    'REQUEST_METHOD': 'GET',
+    'SCRIPT_NAME': '',
+    'PATH_INFO': path,
+    'QUERY_STRING': '',
+    'SERVER_NAME': 'localhost',
+    'SERVER_PORT': '8080',
+    'SERVER_PROTOCOL': 'HTTP/1.1',
+    'wsgi.version': (1, 0),
+    'wsgi.url_scheme': 'http',
+    'wsgi.input': StringIO(''),
+    'wsgi.errors': sys.stderr,
+    'wsgi.multithread': False,
+    'wsgi.multiprocess': False,
+    'wsgi.run_once': False,
+  }
+  status = []
+  def start_response(line, headers, exc_info=None):
+    status.append(int(line.split()[0]))
+    return lambda data: None
+  body = application(environ, start_response)
+  try:
+    for chunk in body:
+      pass
+  finally:
+    if hasattr(body, 'close'):
+      body.close()
+  return status[0]
+
+def child(mode, path, feed_file, emails):
+  """One cold start; writes "import-seconds request-seconds status loaded"."""
+  from google.appengine.ext import testbed
+
+  bed = testbed.Testbed()
+  bed.activate()
+  bed.init_datastore_v3_stub()
+  bed.init_memcache_stub()
+  os.chdir(ROOT)
+
+  from models import get_dashboards, store_documents
+  feed = open(feed_file, 'rb').read()
+  store_documents([(dash, {'atom': feed}) for dash in get_dashboards(emails)])
+
+  if mode == 'no-snapshot':
+    # A None entry makes "import config_snapshot" fail
+    sys.modules['config_snapshot'] = None
+  before = set(sys.modules)
+
+  start = time.time()
+  if mode == 'eager':
+    for name in EAGER:
+      __import__(name)
+    import settings
+    settings.parse()
+  app = imp.load_source('tumblr_dashboard_feed',
+                        os.path.join(ROOT, 'tumblr-dashboard-feed.py'))
+  imported = time.time()
+  status = _get(app.application, path)
+  served = time.time()
+
+  loaded = [name for name in WATCHED
+            if sys.modules.get(name) is not None and name not in before]
+  sys.stdout.write('%f %f %d %s\n' % (imported - start, served - imported, status,
+                                      ','.join(loaded) or '-'))
+
+##########
+# Parent #
+##########
+def render_feed(posts):
+  """A feed for the main account, rendered from a synthetic dashboard."""
+  import settings
+  from dashboard import xml_to_atom
+  from loadtest import synthetic_dashboard
+
+  account = settings.load()[0]
+  return xml_to_atom(synthetic_dashboard(posts), account['title'],
+                     account['description'], account['url'], account['email'],
+                     account['img_size'], account['collapse_reblogs'],
+                     account['hub'])
+
+def cold_start(mode, path, feed_file, emails):
+  """Run one child process; returns (import s, request s, status, loaded)."""
+  process = subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                              '--child', mode, '--path', path, feed_file] + emails,
+                             stdout=subprocess.PIPE)
+  output = process.communicate()[0]
+  if process.returncode:
+    raise RuntimeError('%s run failed with status %d' % (mode, process.returncode))
+  imported, served, status, loaded = output.split()[-4:]
+  return float(imported), float(served), int(status), loaded
+
+def median(values):
+  values = sorted(values)
+  middle = len(values) / 2
+  if len(values) % 2:
+    return values[middle]
+  return (values[middle - 1] + values[middle]) / 2.0
+
+def report(results, out=sys.stdout):
+  """Print the median timings of each mode.
+
+  :param list results: (mode, [(import s, request s, status, loaded), ...]) pairs
+  """
+  out.write('%-12s %5s %10s %14s %10s  %s\n' %
+            ('mode', 'runs', 'import', 'first request', 'total', 'loaded'))
+  for mode, runs in results:
+    imports = [run[0] for run in runs]
+    requests = [run[1] for run in runs]
+    totals = [run[0] + run[1] for run in runs]
+    out.write('%-12s %5d %8.1fms %12.1fms %8.1fms  %s\n' %
+              (mode, len(runs), median(imports) * 1000, median(requests) * 1000,
+               median(totals) * 1000, runs[-1][3]))
+    failed = [run[2] for run in runs if run[2] != 200]
+    if failed:
+      out.write('  %d run(s) answered %s\n' % (len(failed), failed[0]))
+
+def main(argv=None):
+  parser = optparse.OptionParser(usage='%prog [options]')
+  parser.add_option('--runs', type='int', default=10,
+                    help='cold starts for each mode [%default]')
+  parser.add_option('--posts', type='int', default=50,
+                    help='posts in the stored feed [%default]')
+  parser.add_option('--modes', default=','.join(MODES),
+                    help='comma-separated modes to run [%default]')
+  parser.add_option('--path', default='/atom.xml',
+                    help='path of the first request [%default]')
+  parser.add_option('--child', metavar='MODE', help=optparse.SUPPRESS_HELP)
+  options, args = parser.parse_args(argv)
+
+  if options.child:
+    child(options.child, options.path, args[0], args[1:])
+    return
+
+  modes = options.modes.split(',')
+  for mode in modes:
+    if mode not in MODES:
+      parser.error('unknown mode %r; choose from %s' % (mode, ', '.join(MODES)))
+  if not os.path.exists(os.path.join(ROOT, 'config_snapshot.py')):
+    sys.stderr.write('no config_snapshot.py, so lazy and no-snapshot are the same; '
+                     'run python settings.py to make one\n')
+
+  import settings
+  emails = [account['email'] for account in settings.load()]
+  handle, feed_file = tempfile.mkstemp(suffix='.xml')
+  try:
+    os.write(handle, render_feed(options.posts))
+    os.close(handle)
+    results = []
+    for mode in modes:
+      results.append((mode, [cold_start(mode, options.path, feed_file, emails)
+                             for i in range(options.runs)]))
+  finally:
+    os.remove(feed_file)
+  report(results)
+
+if __name__ == '__main__':
+  main()
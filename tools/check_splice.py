@@ -0,0 +1,86 @@
+"""Check that feeds spliced from the entry cache match normal serialization.
+
+Feed.format_atom_string reuses the XML of entries it has serialized before
+(see UpdateDB's entry cache). This renders synthetic dashboards both ways
+and checks, byte for byte, that:
+
+  * a feed made with an empty cache matches one made without a cache,
+  * a second dashboard, with some entries new, some changed and some
+    dropped, made with the first run's cache matches one made without,
+  * the cache then holds exactly the second feed's entries.
+
+Only needs the app's own modules, not the App Engine SDK:
+
+  python tools/check_splice.py --posts 200
+"""
+import os
+import sys
+import copy
+import optparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from dashboard import make_feed, parse_posts, render_posts
+from feedformatter.feedformatter import _entry_cache_key
+from loadtest import synthetic_dashboard
+
+def fail(message):
+  sys.stderr.write('FAIL: %s\n' % message)
+  sys.exit(1)
+
+def format_atom(entries, entry_cache=None):
+  """Serialize entries without pretty printing, which would bypass the cache."""
+  feed = make_feed('Check', 'Splice check', 'http://check.example.com/',
+                   'check@example.com')
+  feed.entries = entries
+  return feed.format_atom_string(entry_cache=entry_cache)
+
+def compare(label, expected, spliced):
+  if spliced == expected:
+    return
+  for offset in range(min(len(expected), len(spliced))):
+    if expected[offset] != spliced[offset]:
+      break
+  else:
+    offset = min(len(expected), len(spliced))
+  fail('%s differs at byte %d of %d:\n  expected %r\n  spliced  %r' %
+       (label, offset, len(expected), expected[max(0, offset-40):offset+40],
+        spliced[max(0, offset-40):offset+40]))
+
+def main(argv=None):
+  parser = optparse.OptionParser(usage='%prog [options]')
+  parser.add_option('--posts', type='int', default=50,
+                    help='posts in each synthetic dashboard [%default]')
+  parser.add_option('--img-size', type='int', default=0,
+                    help='img_size to render photos at [%default]')
+  parser.add_option('--collapse-reblogs', action='store_true',
+                    help='merge reblogs of the same root post')
+  options, args = parser.parse_args(argv)
+
+  def render(seed):
+    xml = synthetic_dashboard(options.posts, seed=seed)
+    return render_posts(parse_posts(xml), options.img_size, options.collapse_reblogs)
+
+  first = render(0)
+  cache = {}
+  compare('first run', format_atom(first), format_atom(first, cache))
+
+  # A few posts from another dashboard, a few edited ones, and the rest of
+  # the first run's except its oldest few
+  changed = max(1, len(first) / 10)
+  edited = [copy.copy(entry) for entry in first[:changed]]
+  for entry in edited:
+    entry.title = entry.title + ' (edited)'
+  second = render(1)[:changed] + edited + first[changed:-changed]
+  compare('second run', format_atom(second), format_atom(second, cache))
+
+  keys = set([_entry_cache_key(entry) for entry in second])
+  if set(cache) != keys:
+    fail('the cache holds %d entries, %d of them not in the second feed' %
+         (len(cache), len(set(cache) - keys)))
+  sys.stdout.write('ok: %d and %d entries spliced identically\n' %
+                   (len(first), len(second)))
+
+if __name__ == '__main__':
+  main()
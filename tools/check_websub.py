@@ -0,0 +1,90 @@
+"""Check that an update with new entries pings the WebSub hub once.
+
+Runs /update against the stubbed datastore, memcache and task queue, with
+the dashboard fetch replaced by a synthetic dashboard and the hub pointed
+at the app's own stand-in hub (/websub/hub, served on a local socket).
+Then checks that:
+
+  * the first update queues exactly one /websub/publish task,
+  * running that task reaches the stand-in hub with the account's feed URL,
+  * a second update with no new entries queues nothing.
+
+Needs the App Engine SDK on the path, e.g.
+
+  PYTHONPATH=/opt/google_appengine:/opt/google_appengine/lib/webob \\
+    python tools/check_websub.py
+"""
+import os
+import sys
+import base64
+import httplib
+
+from google.appengine.api import memcache
+from google.appengine.ext import testbed
+
+from loadtest import load_app, serve_on_socket, wsgi_request, \
+                     synthetic_account, synthetic_dashboard
+
+def fail(message):
+  sys.stderr.write('FAIL: %s\n' % message)
+  sys.exit(1)
+
+def websub_tasks(bed):
+  return bed.get_stub(testbed.TASKQUEUE_SERVICE_NAME).GetTasks('websub')
+
+def run_task(port, task):
+  """POST a queued task to the app, as the task queue would.
+
+  :returns: The response status
+  """
+  headers = dict(task['headers'])
+  connection = httplib.HTTPConnection('127.0.0.1', port)
+  try:
+    connection.request(task['method'], task['url'], base64.b64decode(task['body']),
+                       {'Content-Type': headers.get('Content-Type',
+                                                    'application/x-www-form-urlencoded')})
+    response = connection.getresponse()
+    response.read()
+    return response.status
+  finally:
+    connection.close()
+
+def main():
+  # The stand-in hub is only routed on the development server
+  os.environ['SERVER_SOFTWARE'] = 'Development/check_websub'
+  app, bed = load_app()
+  server, port = serve_on_socket(app.application)
+
+  hub = 'http://127.0.0.1:%d/websub/hub' % port
+  account = synthetic_account(hub)
+  app.settings._accounts = [account]
+  xml = synthetic_dashboard(20)
+  app.fetch_tumblr_dashboard_xml = lambda email, password, **kwargs: \
+    app.FetchResult(True, xml, status=200, attempts=1)
+
+  status, headers, body = wsgi_request(app.application, '/update', {})
+  if status != 200:
+    fail('first /update answered %d' % status)
+  tasks = websub_tasks(bed)
+  if len(tasks) != 1 or tasks[0]['url'] != '/websub/publish':
+    fail('expected one /websub/publish task, got %r' % [task['url'] for task in tasks])
+
+  status = run_task(port, tasks[0])
+  if status != 200:
+    fail('/websub/publish answered %d' % status)
+  pings = memcache.get('websub-local-hub') or []
+  topic = account['url'] + 'atom.xml'
+  if len([ping for ping in pings if ping.endswith(' '+topic)]) != 1:
+    fail('the stand-in hub got %r, not one ping for %s' % (pings, topic))
+
+  bed.get_stub(testbed.TASKQUEUE_SERVICE_NAME).FlushQueue('websub')
+  wsgi_request(app.application, '/update', {})
+  if websub_tasks(bed):
+    fail('an update with no new entries queued a ping')
+
+  server.shutdown()
+  bed.deactivate()
+  sys.stdout.write('ok: one ping per update with new entries, and it reached the hub\n')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,464 @@
+"""Load test for the feed-serving path (/atom.xml).
+
+Seeds the datastore stub with a synthetic or recorded dashboard, renders the
+feed the same way UpdateDB does, and then hammers the WSGI application either
+in-process or over a local socket.  Reports throughput, a latency histogram
+and bytes sent, broken down by request mix (plain, gzip, conditional GET).
+
+The app leaves compression to App Engine's frontend, which gzips responses
+for clients that accept it, so for the gzip mixes the bytes are those of the
+gzipped body unless the response was already encoded.  Conditional mixes are
+only run if the first response carries an ETag or Last-Modified to send back;
+the app sends neither at the moment, so they are dropped with a note.
+
+Needs the App Engine SDK on the path, e.g.
+
+  PYTHONPATH=/opt/google_appengine:/opt/google_appengine/lib/webob \\
+    python tools/loadtest.py --posts 500 --concurrency 8 --requests 2000
+"""
+import imp
+import os
+import gzip
+import sys
+import time
+import random
+import socket
+import httplib
+import optparse
+import threading
+from StringIO import StringIO
+from xml.sax.saxutils import escape
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Request mixes: name -> (accept gzip, conditional)
+MIXES = {
+  'plain': (False, False),
+  'gzip': (True, False),
+  'conditional': (False, True),
+  'conditional+gzip': (True, True),
+}
+
+# Upper bounds (in ms) of the latency histogram buckets
+BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+#########################
+# Synthetic dashboards  #
+#########################
+_WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do '
+          'eiusmod tempor incididunt ut labore et dolore magna aliqua').split()
+
+def _text(rand, words):
+  return ' '.join([rand.choice(_WORDS) for i in range(words)])
+
+def synthetic_dashboard(posts=50, body_words=80, seed=0):
+  """Make dashboard XML shaped like Tumblr's, with every post type.
+
+  :param int posts: Number of posts to generate
+  :param int body_words: Rough number of words in each post's text
+  :param int seed: Seed for the random number generator
+  :returns: The dashboard XML, as a string
+  """
+  rand = random.Random(seed)
+  types = ['regular', 'link', 'quote', 'photo', 'conversation',
+           'video', 'audio', 'answer']
+  now = time.time()
+  out = StringIO()
+  out.write('<?xml version="1.0" encoding="UTF-8"?>\n<tumblr version="1.0"><posts>')
+  for i in range(posts):
+    posttype = types[i % len(types)]
+    blog = 'blog%d' % rand.randint(0, 40)
+    url = 'http://%s.tumblr.com/' % blog
+    date = time.strftime('%Y-%m-%d %H:%M:%S GMT', time.gmtime(now - i * 600))
+    attribs = 'id="%d" url-with-slug="%spost/%d/slug" type="%s" date-gmt="%s"' % \
+              (1000000 - i, url, 1000000 - i, posttype, date)
+    if rand.random() < 0.5:
+      root = rand.randint(0, posts / 4 + 1)
+      attribs += (' reblogged-from-name="from%d" reblogged-from-url="http://from%d.tumblr.com/post/%d"'
+                  ' reblogged-root-name="root%d" reblogged-root-url="http://root%d.tumblr.com/post/%d"') % \
+                 (i, i, i, root, root, root)
+    out.write('<post %s><tumblelog title="%s" name="%s" url="%s"/>' %
+              (attribs, blog.title(), blog, url))
+    body = escape('<p>%s</p>' % _text(rand, body_words))
+    if posttype == 'regular':
+      out.write('<regular-title>%s</regular-title><regular-body>%s</regular-body>' %
+                (_text(rand, 5), body))
+    elif posttype == 'link':
+      out.write('<link-text>%s</link-text><link-url>http://example.com/%d</link-url>'
+                '<link-description>%s</link-description>' % (_text(rand, 4), i, body))
+    elif posttype == 'quote':
+      out.write('<quote-text>%s</quote-text><quote-source>%s</quote-source>' %
+                (body, _text(rand, 3)))
+    elif posttype == 'photo':
+      out.write('<photo-caption>%s</photo-caption>' % body)
+      for width in (1280, 500, 400, 250, 100, 75):
+        out.write('<photo-url max-width="%d">http://media.tumblr.com/%d_%d.jpg</photo-url>' %
+                  (width, i, width))
+    elif posttype == 'conversation':
+      out.write('<conversation-title>%s</conversation-title><conversation>' % _text(rand, 4))
+      for j in range(4):
+        out.write('<line label="person%d:">%s</line>' % (j % 2, _text(rand, body_words / 4)))
+      out.write('</conversation>')
+    elif posttype == 'video':
+      out.write('<video-caption>%s</video-caption><video-player>%s</video-player>' %
+                (body, escape('<embed src="http://example.com/v%d.swf"></embed>' % i)))
+    elif posttype == 'audio':
+      out.write('<audio-caption>%s</audio-caption><audio-player>%s</audio-player>' %
+                (body, escape('<embed src="http://example.com/a%d.swf"></embed>' % i)))
+    elif posttype == 'answer':
+      out.write('<question>%s?</question><answer>%s</answer>' % (_text(rand, 8), body))
+    for j in range(rand.randint(0, 4)):
+      out.write('<tag>%s</tag>' % rand.choice(_WORDS))
+    out.write('</post>')
+  out.write('</posts></tumblr>')
+  return out.getvalue()
+
+###########
+# Seeding #
+###########
+def load_app():
+  """Import the app with the datastore and memcache stubbed out.
+
+  :returns: (app module, testbed), with the testbed activated
+  """
+  from google.appengine.ext import testbed
+
+  bed = testbed.Testbed()
+  bed.activate()
+  bed.init_datastore_v3_stub()
+  bed.init_memcache_stub()
+  bed.init_taskqueue_stub(root_path=ROOT)
+
+  os.chdir(ROOT)
+  sys.path.insert(0, ROOT)
+  app = imp.load_source('tumblr_dashboard_feed',
+                        os.path.join(ROOT, 'tumblr-dashboard-feed.py'))
+  return app, bed
+
+def synthetic_account(hub=''):
+  """An account to serve at /atom.xml, so no config.ini is needed."""
+  return {'name': None, 'email': 'loadtest@example.com', 'password': 'secret',
+          'title': 'Load test', 'description': 'Synthetic dashboard feed',
+          'url': 'http://loadtest.example.com/', 'img_size': 0,
+          'collapse_reblogs': False, 'hub': hub}
+
+def seed(app, xml):
+  """Make a synthetic account the app's only one, and store xml and its
+  documents for it, like UpdateDB does.
+
+  :returns: Length of the feed, in bytes
+  """
+  from models import get_dashboards, store_documents
+
+  account = synthetic_account()
+  app.settings._accounts = [account]
+  dash = get_dashboards([account['email']])[0]
+  documents, ids = app.render_documents(xml, account)
+  store_documents([(dash, documents)])
+  return len(documents['atom'])
+
+###########
+# Drivers #
+###########
+def _headers(mix, validators):
+  accept_gzip, conditional = MIXES[mix]
+  headers = {}
+  if accept_gzip:
+    headers['Accept-Encoding'] = 'gzip'
+  if conditional:
+    if validators.get('etag'):
+      headers['If-None-Match'] = validators['etag']
+    if validators.get('last-modified'):
+      headers['If-Modified-Since'] = validators['last-modified']
+  return headers
+
+def wsgi_request(application, path, headers):
+  """Call the WSGI application directly.
+
+  :returns: (status code, response headers, body)
+  """
+  environ = {
+    'REQUEST_METHOD': 'GET',
+    'SCRIPT_NAME': '',
+    'PATH_INFO': path.split('?')[0],
+    'QUERY_STRING': '?' in path and path.split('?', 1)[1] or '',
+    'SERVER_NAME': 'localhost',
+    'SERVER_PORT': '8080',
+    'SERVER_PROTOCOL': 'HTTP/1.1',
+    'wsgi.version': (1, 0),
+    'wsgi.url_scheme': 'http',
+    'wsgi.input': StringIO(''),
+    'wsgi.errors': sys.stderr,
+    'wsgi.multithread': True,
+    'wsgi.multiprocess': False,
+    'wsgi.run_once': False,
+  }
+  for name, value in headers.items():
+    environ['HTTP_' + name.upper().replace('-', '_')] = value
+
+  started = {}
+  def start_response(status, response_headers, exc_info=None):
+    started['status'] = int(status.split()[0])
+    started['headers'] = dict([(k.lower(), v) for k, v in response_headers])
+    return lambda data: None
+
+  chunks = []
+  body = application(environ, start_response)
+  try:
+    for chunk in body:
+      chunks.append(chunk)
+  finally:
+    if hasattr(body, 'close'):
+      body.close()
+  return started['status'], started['headers'], ''.join(chunks)
+
+def serve_on_socket(application):
+  """Serve the application from a thread on a free local port.
+
+  :returns: (server, port)
+  """
+  from SocketServer import ThreadingMixIn
+  from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+
+  class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+  class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+      pass
+
+  server = make_server('127.0.0.1', 0, application,
+                       server_class=ThreadingWSGIServer,
+                       handler_class=QuietHandler)
+  thread = threading.Thread(target=server.serve_forever)
+  thread.setDaemon(True)
+  thread.start()
+  return server, server.server_address[1]
+
+def socket_request(port, path, headers):
+  """Make a GET request over a real socket.
+
+  :returns: (status code, response headers, body)
+  """
+  connection = httplib.HTTPConnection('127.0.0.1', port)
+  try:
+    connection.request('GET', path, headers=headers)
+    response = connection.getresponse()
+    body = response.read()
+    return response.status, dict(response.getheaders()), body
+  finally:
+    connection.close()
+
+def gzipped_length(body):
+  """Length of body once gzipped, as the frontend would send it."""
+  out = StringIO()
+  compressor = gzip.GzipFile(fileobj=out, mode='wb')
+  compressor.write(body)
+  compressor.close()
+  return len(out.getvalue())
+
+###########
+# Running #
+###########
+class Stats(object):
+  """Latencies, statuses and bytes for one request mix."""
+  def __init__(self):
+    self.latencies = []
+    self.statuses = {}
+    self.bytes = 0
+    self.errors = 0
+
+  def add(self, latency, status, length):
+    """Record one request; length is the bytes it would put on the wire."""
+    self.latencies.append(latency)
+    self.statuses[status] = self.statuses.get(status, 0) + 1
+    self.bytes += length
+
+def percentile(values, p):
+  if not values:
+    return 0.0
+  values = sorted(values)
+  return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+def run(request, path, concurrency, total, mixes):
+  """Make total requests from concurrency threads.
+
+  :param request: Function taking (path, headers) and returning
+    (status, headers, body)
+  :param list mixes: Names of the request mixes to choose from, uniformly;
+    conditional ones are dropped if the app sends no validators
+  :returns: (dictionary of mix name -> Stats, elapsed seconds)
+  """
+  lock = threading.Lock()
+  remaining = [total]
+  validators = {}
+  compressed = {}
+
+  # One request up front, so conditional requests have validators to send
+  status, headers, body = request(path, {})
+  headers = dict([(k.lower(), v) for k, v in headers.items()])
+  validators['etag'] = headers.get('etag')
+  validators['last-modified'] = headers.get('last-modified')
+  if not validators['etag'] and not validators['last-modified']:
+    dropped = [mix for mix in mixes if MIXES[mix][1]]
+    if dropped:
+      sys.stderr.write('%s answered without an ETag or Last-Modified; '
+                       'not running %s\n' % (path, ', '.join(dropped)))
+      mixes = [mix for mix in mixes if not MIXES[mix][1]]
+  if not mixes:
+    raise ValueError('no request mixes left to run')
+  stats = dict([(mix, Stats()) for mix in mixes])
+
+  def wire_length(mix, headers, body):
+    if not MIXES[mix][0] or 'gzip' in headers.get('content-encoding', ''):
+      return len(body)
+    # The frontend would gzip it; the body rarely changes, so remember it
+    lock.acquire()
+    try:
+      if body not in compressed:
+        compressed[body] = gzipped_length(body)
+      return compressed[body]
+    finally:
+      lock.release()
+
+  def worker(rand):
+    while True:
+      lock.acquire()
+      try:
+        if remaining[0] <= 0:
+          return
+        remaining[0] -= 1
+      finally:
+        lock.release()
+      mix = rand.choice(mixes)
+      start = time.time()
+      try:
+        status, headers, body = request(path, _headers(mix, validators))
+      except (socket.error, httplib.HTTPException):
+        lock.acquire()
+        stats[mix].errors += 1
+        lock.release()
+        continue
+      latency = time.time() - start
+      headers = dict([(k.lower(), v) for k, v in headers.items()])
+      length = wire_length(mix, headers, body)
+      lock.acquire()
+      stats[mix].add(latency, status, length)
+      lock.release()
+
+  threads = [threading.Thread(target=worker, args=(random.Random(i),))
+             for i in range(concurrency)]
+  start = time.time()
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  return stats, time.time() - start
+
+def histogram(latencies):
+  counts = [0] * (len(BUCKETS) + 1)
+  for latency in latencies:
+    ms = latency * 1000
+    for i, bound in enumerate(BUCKETS):
+      if ms <= bound:
+        counts[i] += 1
+        break
+    else:
+      counts[-1] += 1
+  return counts
+
+def report(stats, elapsed, out=sys.stdout):
+  everything = Stats()
+  for mix_stats in stats.values():
+    everything.latencies.extend(mix_stats.latencies)
+    everything.bytes += mix_stats.bytes
+    everything.errors += mix_stats.errors
+    for status, count in mix_stats.statuses.items():
+      everything.statuses[status] = everything.statuses.get(status, 0) + count
+
+  requests = len(everything.latencies)
+  out.write('%d requests in %.2fs: %.1f req/s, %.1f KB/s, %d errors\n' %
+            (requests, elapsed, requests / elapsed,
+             everything.bytes / 1024.0 / elapsed, everything.errors))
+  out.write('%-18s %7s %9s %8s %8s %8s %8s  %s\n' %
+            ('mix', 'count', 'avg KB', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'statuses'))
+  rows = stats.items()
+  rows.sort()
+  rows.append(('all', everything))
+  for mix, mix_stats in rows:
+    count = len(mix_stats.latencies)
+    if not count:
+      continue
+    statuses = ' '.join(['%s:%d' % item for item in sorted(mix_stats.statuses.items())])
+    out.write('%-18s %7d %9.1f %8.2f %8.2f %8.2f %8.2f  %s\n' %
+              (mix, count, mix_stats.bytes / 1024.0 / count,
+               percentile(mix_stats.latencies, 50) * 1000,
+               percentile(mix_stats.latencies, 90) * 1000,
+               percentile(mix_stats.latencies, 99) * 1000,
+               max(mix_stats.latencies) * 1000, statuses))
+
+  out.write('\nlatency histogram (all mixes)\n')
+  counts = histogram(everything.latencies)
+  widest = max(counts) or 1
+  labels = ['<= %d ms' % bound for bound in BUCKETS] + ['> %d ms' % BUCKETS[-1]]
+  for label, count in zip(labels, counts):
+    out.write('%10s %7d %s\n' % (label, count, '#' * (50 * count / widest)))
+
+def main(argv=None):
+  parser = optparse.OptionParser(usage='%prog [options]')
+  parser.add_option('--fixture', metavar='FILE',
+                    help='recorded dashboard XML to serve (default: synthetic)')
+  parser.add_option('--posts', type='int', default=50,
+                    help='posts in the synthetic dashboard [%default]')
+  parser.add_option('--body-words', type='int', default=80,
+                    help='words of text per synthetic post [%default]')
+  parser.add_option('--mode', choices=('wsgi', 'socket'), default='wsgi',
+                    help='drive the app in-process or over a socket [%default]')
+  parser.add_option('--concurrency', type='int', default=4,
+                    help='concurrent clients [%default]')
+  parser.add_option('--requests', type='int', default=1000,
+                    help='total requests [%default]')
+  parser.add_option('--mix', default=','.join(sorted(MIXES)),
+                    help='comma-separated request mixes, from %s [%%default]' %
+                         ', '.join(sorted(MIXES)))
+  parser.add_option('--path', default='/atom.xml',
+                    help='path to request [%default]')
+  options, args = parser.parse_args(argv)
+
+  mixes = [mix.strip() for mix in options.mix.split(',') if mix.strip()]
+  for mix in mixes:
+    if mix not in MIXES:
+      parser.error('unknown mix %r' % mix)
+
+  if options.fixture:
+    xml = open(options.fixture).read()
+  else:
+    xml = synthetic_dashboard(options.posts, options.body_words)
+
+  app, bed = load_app()
+  try:
+    size = seed(app, xml)
+    sys.stdout.write('seeded %d byte dashboard as a %d byte feed\n' % (len(xml), size))
+
+    if options.mode == 'wsgi':
+      request = lambda path, headers: wsgi_request(app.application, path, headers)
+      server = None
+    else:
+      server, port = serve_on_socket(app.application)
+      request = lambda path, headers: socket_request(port, path, headers)
+
+    try:
+      try:
+        stats, elapsed = run(request, options.path, options.concurrency,
+                             options.requests, mixes)
+      except ValueError, e:
+        parser.error(str(e))
+    finally:
+      if server is not None:
+        server.shutdown()
+    report(stats, elapsed)
+  finally:
+    bed.deactivate()
+
+if __name__ == '__main__':
+  main()
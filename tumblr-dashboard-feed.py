@@ -1,49 +1,96 @@
-import cgi
+import os
 import time
-import httplib
-import urllib
-import wsgiref.handlers
+import logging
 
-from google.appengine.ext import db
-from google.appengine.api import users
 from google.appengine.ext import webapp
 from google.appengine.ext.webapp.util import run_wsgi_app
 
-from StringIO import StringIO
-from ConfigParser import RawConfigParser
-from feedformatter.feedformatter import Feed
-try:
-  from xml.etree.cElementTree import XML
-except ImportError:
-  from xml.etree.ElementTree import XML
+import settings
+from models import get_dashboards, load_documents, store_documents
 
-###########################
-# Setup (config, logging) #
-###########################
-_defaults = {
-  'tumblr': {
-             'email': 'example@example.com',
-             'password': 'example',
-            },
-  'feed': {
-           'title': 'My Dashboard Feed',
-           'description': 'My Tumblr Dashboard feed',
-           'img_size': 0,
-          },
-            }
-
-_config = RawConfigParser(_defaults)
-_config.read('config.ini')
+# Serving a stored feed only needs the modules above. Parsing, rendering,
+# fetching and publishing (dashboard, feedformatter, urlfetch, memcache,
+# pickle and friends) are imported by the functions that use them,
+# so a new instance can answer its first /atom.xml without loading them.
 
 #############
 # Functions #
 #############
-def fetch_tumblr_dashboard_xml(email,password):
+class FetchResult(object):
+  """The outcome of a Tumblr Dashboard API read.
+  
+  If ok is True, body holds the raw XML. Otherwise error says what went
+  wrong ('circuit-open', 'timeout', 'network', 'http' or 'deadline') and
+  message describes it for humans.
+  """
+  def __init__(self,ok,body=None,error=None,message='',status=None,
+               attempts=0,elapsed=0.0):
+    self.ok = ok
+    self.body = body
+    self.error = error
+    self.message = message
+    self.status = status
+    self.attempts = attempts
+    self.elapsed = elapsed
+  
+  def __repr__(self):
+    return '<FetchResult ok=%r error=%r status=%r attempts=%d elapsed=%.2fs>' % \
+      (self.ok, self.error, self.status, self.attempts, self.elapsed)
+
+class CircuitBreaker(object):
+  """Stops calling a failing service until a cool-down has passed.
+  
+  State is kept in memcache, so it is shared by all instances.
+  
+  :param string name: Prefix for the memcache keys
+  :param int threshold: Consecutive failures before the circuit opens
+  :param int cooldown: Seconds to stay open before trying again
+  """
+  def __init__(self,name,threshold=3,cooldown=300):
+    self.name = name
+    self.threshold = threshold
+    self.cooldown = cooldown
+  
+  def allow(self):
+    from google.appengine.api import memcache
+    return not memcache.get(self.name+':open')
+  
+  def success(self):
+    from google.appengine.api import memcache
+    memcache.delete_multi([self.name+':failures', self.name+':open'])
+  
+  def failure(self):
+    from google.appengine.api import memcache
+    failures = memcache.incr(self.name+':failures', initial_value=0)
+    if failures is not None and failures >= self.threshold:
+      logging.warning('%s failed %d times in a row; backing off for %ds',
+                      self.name, failures, self.cooldown)
+      memcache.set(self.name+':open', True, time=self.cooldown)
+      memcache.delete(self.name+':failures')
+
+def fetch_tumblr_dashboard_xml(email,password,timeout=15,deadline=30,retries=2,
+                               backoff=1.0,breaker=None):
   """Implements a Tumblr Dashboard API read
   
+  Transient failures (network errors, timeouts and 5xx responses) are
+  retried with jittered exponential backoff, as long as the deadline allows.
+  
   :param string email: Tumblr account email address
   :param string password: tumblr account password
+  :param float timeout: Seconds to wait for each attempt
+  :param float deadline: Seconds after which no more attempts are made
+  :param int retries: Number of retries after the first attempt
+  :param float backoff: Base delay in seconds between attempts
+  :param CircuitBreaker breaker: Skips the fetch if Tumblr keeps failing
+  :returns: A FetchResult
   """
+  import random
+  import urllib
+  from google.appengine.api import urlfetch
+  
+  if breaker is not None and not breaker.allow():
+    return FetchResult(False, error='circuit-open',
+                       message='Tumblr has been failing; not fetching until the cool-down ends')
   
   # Prepare POST request
   params = urllib.urlencode([('email',email),('password',password),
@@ -52,267 +99,307 @@ def fetch_tumblr_dashboard_xml(email,password):
   headers = {"Content-type": "application/x-www-form-urlencoded",
              "Accept": "text/plain"}
   
-  connection = httplib.HTTPConnection("www.tumblr.com")
-  connection.request("POST", "/api/dashboard", params,headers)
-  response = connection.getresponse()
-  connection.close()
+  start = time.time()
+  attempts = 0
+  while True:
+    remaining = deadline - (time.time() - start)
+    if attempts and remaining <= 0:
+      # The sleep before this retry ran past the deadline
+      result.error = 'deadline'
+      result.message += ' (gave up at the %ds deadline)' % deadline
+      break
+    attempts += 1
+    transient = True
+    try:
+      response = urlfetch.fetch("http://www.tumblr.com/api/dashboard",
+                                payload=params, method=urlfetch.POST,
+                                headers=headers, follow_redirects=False,
+                                deadline=min(timeout, remaining))
+    except urlfetch.DeadlineExceededError:
+      result = FetchResult(False, error='timeout',
+                           message='Connection failed. Timed out')
+    except urlfetch.DownloadError, e:
+      result = FetchResult(False, error='network',
+                           message='Connection failed. %s' % e)
+    else:
+      if response.status_code == 200:
+        if breaker is not None:
+          breaker.success()
+        return FetchResult(True, response.content, status=response.status_code,
+                           attempts=attempts, elapsed=time.time() - start)
+      result = FetchResult(False, error='http', status=response.status_code,
+                           message='Connection failed. Response %s' % response.status_code)
+      transient = response.status_code >= 500
+    
+    if not transient or attempts > retries:
+      break
+    # Full jitter keeps many instances from retrying in lockstep
+    delay = random.uniform(0, backoff * 2 ** (attempts - 1))
+    if time.time() - start + delay >= deadline:
+      result.error = 'deadline'
+      result.message += ' (gave up at the %ds deadline)' % deadline
+      break
+    time.sleep(delay)
   
-  if str(response.status) == '200':
-    return (True, response.read())
-  else:
-    return (False,'Connection failed. Response %s, %s' % (response.status, response.reason))
+  if transient and breaker is not None:
+    breaker.failure()
+  result.attempts = attempts
+  result.elapsed = time.time() - start
+  return result
 
-def xml_to_atom(xml,feedtitle,feeddescription,feedurl,authoremail,img_size=0):
-  """Transform the XML from Tumblr into an Atom feed.
+def render_feed(entries,account,**kwargs):
+  """Make an account's Atom feed from rendered entries, with its settings.
   
-  :param string xml: Raw XML returned from Tumblr
-  :param string feedtitle: Title of the atom feed
-  :param string feeddescription: Description of the atom feed
-  :param string feedurl: URL that will contain the feed
-  :param int img_size: Size of images to include; 0-5 (0 is original, 5 is small)
-  :returns: The Atom feed's XML
+  Extra keyword arguments are passed on to entries_to_atom.
   """
-  # Make sure parameters are "good"
-  if feedurl.endswith('atom.xml'):
-    pass
-  elif feedurl[-1] == '/':
-    feedurl = feedurl+'atom.xml'
-  else:
-    feedurl = feedurl+'/atom.xml'
+  from dashboard import entries_to_atom
   
-  if type(img_size) is not int:
-    img_size = int(img_size)
+  return entries_to_atom(entries,account['title'],
+                                 account['description'],
+                                 account['url'],
+                                 account['email'],
+                                 account['hub'],
+                                 **kwargs)
+
+def render_documents(xml,account,entry_cache=None):
+  """Render dashboard XML into the documents stored for an account.
   
-  # Set up the Atom feed
-  atom = Feed()
-  atom.feed["title"] = feedtitle
-  atom.feed["description"] = feeddescription
-  atom.feed["id"] = feedurl
-  atom.feed["link"] = {'_href': feedurl,
-                       '_rel': 'self',
-                       '_type': 'application/atom+xml'}
-  atom.feed["generator"] = {'_uri': "http://github.com/tbekolay/Tumblr-Dashboard-Feed",
-                            '_version': '0.1',
-                            'text': 'Tumblr Dashboard Reader'}
-  atom.feed["icon"] = "http://assets.tumblr.com/images/favicon.gif"
-  atom.feed["logo"] = "http://assets.tumblr.com/images/logo.png"
-  atom.feed["author"] = {'name':authoremail.split('@')[0], 'email':authoremail}
-  atom.feed["updated"] = time.gmtime()
+  These are the XML itself, the Atom feed, and the pickled entries, whose
+  photo manifests let Tumblr serve other image sizes without the XML.
   
-  # Start parsing the XML file
-  et = XML(xml)
-  posts = et.find('posts')
+  :returns: (dict of document name -> text, for store_documents,
+    list of the feed's entry ids)
+  """
+  import cPickle as pickle
+  from dashboard import iter_posts, render_posts
+  
+  entries = render_posts(iter_posts(xml),account['img_size'],
+                         account['collapse_reblogs'])
+  documents = {'xml': xml,
+               'atom': render_feed(entries, account, entry_cache=entry_cache),
+               'entries': pickle.dumps(entries, pickle.HIGHEST_PROTOCOL)}
+  return documents, [entry.id for entry in entries]
+
+def publish_to_hub(hub,topics,timeout=10):
+  """Tell a WebSub hub that the given topic URLs have new content.
+  
+  :param string hub: URL of the WebSub hub
+  :param list topics: Feed URLs that have been updated
+  :param float timeout: Seconds to wait for the hub
+  :returns: A (success, message) tuple
+  """
+  import urllib
+  from google.appengine.api import urlfetch
+  
+  params = urllib.urlencode([('hub.mode','publish')] +
+                            [('hub.url',topic) for topic in topics])
+  headers = {"Content-type": "application/x-www-form-urlencoded"}
+  
+  try:
+    response = urlfetch.fetch(hub, payload=params, method=urlfetch.POST,
+                              headers=headers, deadline=timeout)
+  except urlfetch.DeadlineExceededError:
+    return (False, 'Publish failed. Timed out after %ds' % timeout)
+  except urlfetch.DownloadError, e:
+    return (False, 'Publish failed. %s' % e)
+  
+  if 200 <= response.status_code < 300:
+    return (True, 'Published %d topic(s)' % len(topics))
+  else:
+    return (False, 'Publish failed. Response %s' % response.status_code)
+
+class MainPage(webapp.RequestHandler):
+  def get(self):
+    self.response.out.write("<html><body>Under construction</body></html>")
+
+class UpdateDB(webapp.RequestHandler):
+  # Seconds that fetching and rendering may take across all accounts,
+  # leaving the rest of the request deadline for storing the results
+  deadline = 20
+  # Accounts aren't fetched with less time than this left
+  min_fetch_time = 2
   
-  for post in posts.findall('post'):
-    # Information common to all types
-    item = {}
-    item["id"] = post.attrib.get('url-with-slug')
-    item["link"] = {'_href': post.attrib.get('url-with-slug'),
-                    '_rel': 'alternate',
-                    '_type': 'text/html'}
-    date = time.strptime(post.attrib.get('date-gmt'),"%Y-%m-%d %H:%M:%S %Z") #2011-09-12 00:33:28 GMT
-    item["published"] = date
-    item["updated"] = date
-    author = post.find('tumblelog')
-    shortname = author.attrib.get('name')
-    item["author"] = {'name': author.attrib.get('title')+" ("+shortname+")",
-                      'uri': author.attrib.get('url')}
-    posttype = post.attrib.get('type')
+  def get(self):
+    """To be run occasionally (via cron)"""
+    from google.appengine.api import memcache
+    from google.appengine.api import taskqueue
+    from dashboard import feed_url, entry_ids
     
-    # Make the summary, based on type
-    if posttype == "regular":
-      item["summary"] = shortname+" posted on Tumblr"
-    elif posttype == "answer":
-      item["summary"] = shortname+" posted an "+posttype
-    elif posttype == "audio":
-      item["summary"] = shortname+" posted "+posttype
-    else:
-      item["summary"] = shortname+" posted a "+posttype
+    accounts = settings.accounts()
+    emails = [account['email'] for account in accounts]
+    # One batch get each for the dashboards and the entry caches, however
+    # many accounts there are
+    dashes = get_dashboards(emails)
+    entry_caches = memcache.get_multi(emails, key_prefix='entry-cache:')
+    # Dashboards stored before their entry ids were need their old feed
+    unlisted = [dash for dash in dashes if dash.is_saved() and not dash.entry_ids]
+    for dash, old_atom in zip(unlisted, load_documents(unlisted, 'atom')):
+      dash.entry_ids = entry_ids(old_atom)
     
-    # Get title and content based on type
-    content = StringIO()
-    #### regular ####
-    if posttype == "regular":
-      if post.find('regular-title') is None:
-        item["title"] = item["summary"]
-      else:
-        item["title"] = post.find('regular-title').text
+    updates = []
+    topics = {}
+    messages = []
+    start = time.time()
+    for account, dash in zip(accounts, dashes):
+      email_s = account['email']
+      # Every fetch shares the run's deadline, so a slow Tumblr can't keep
+      # the accounts that did fetch from being stored
+      remaining = self.deadline - (time.time() - start)
+      if remaining < self.min_fetch_time:
+        logging.warning('Out of time; not fetching %s', email_s)
+        messages.append('%s: Skipped, the update ran out of time' % email_s)
+        continue
+      fetched = fetch_tumblr_dashboard_xml(email_s,account['password'],deadline=remaining,
+                                           breaker=CircuitBreaker('tumblr-fetch:'+email_s))
       
-      if post.find('regular-body') is None:
-        content.write(item["title"])
-        item["title"] = item["summary"]
-      else:
-        content.write(post.find('regular-body').text)
-    #### link ####
-    elif posttype == "link":
-      item["title"] = item["summary"]
+      if not fetched.ok:
+        # If we can't fetch for some reason, skip this account
+        logging.warning('Fetch failed for %s: %r', email_s, fetched)
+        messages.append('%s: %s' % (email_s, fetched.message))
+        continue
       
-      if post.find('link-title') is None:
-        title = post.find('link-url').text
-      else:
-        title = post.find('link-text').text
+      # Most entries are unchanged since the last run, so reuse their XML
+      entry_cache = entry_caches.setdefault(email_s, {})
+      documents, ids = render_documents(fetched.body, account, entry_cache)
       
-      if post.find('link-description') is None:
-        description = "<p>(No description)</p>"
-      else:
-        description = post.find('link-description').text
-      
-      content.write('<a href="%(url)s">%(title)s</a>:%(description)s' % \
-                    {'url':post.find('link-url').text,
-                     'title':title,
-                     'description':description})
-    #### quote  ####
-    elif posttype == "quote":
-      item["title"] = item["summary"]
-      
-      if post.find('quote-source') is None:
-        source = ""
-      else:
-        source = "<p>&mdash;"+post.find('quote-source').text+"</p>"
-      
-      content.write('<p>%(text)s</p>%(source)s' % \
-                    {'text': post.find('quote-text').text,
-                     'source': source})
-    #### photo  ####
-    elif posttype == "photo":
-      item["title"] = item["summary"]
-      
-      photo_urls = []
-      photo_captions = {}
-      
-      if post.find('photoset') is not None:
-        # NOTE: getiterator depricated in 2.7, use iter instead!!
-        for photo in post.find('photoset').getiterator('photo'):
-          url = photo.findall('photo-url')[img_size].text
-          
-          if photo.find('photo-caption') is not None:
-            photo_captions[url] = photo.find('photo-caption').text
-          photo_urls.append(url)
-      
-      else:
-        url = post.findall('photo-url')[img_size].text
-        
-        if post.find('photo-caption') is not None:
-          photo_captions[url] = post.find('photo-caption').text
-        photo_urls.append(url)
-      
-      for url in photo_urls:
-        content.write('<img src="%s" /><br />' % url)
-        if photo_captions.has_key(url):
-          content.write(photo_captions[url])
-    #### conversation ####
-    elif posttype == "conversation":
-      if post.find('conversation-title') is not None:
-        item["title"] = post.find('conversation-title').text
-      else:
-        item["title"] = item["summary"]
-      
-      for line in post.find('conversation').getiterator('line'):
-        content.write("<p><strong>%(label)s</strong> %(text)s" % \
-                      {'label': line.attrib.get('label'),
-                       'text': line.text})
-    #### video ####
-    elif posttype == "video":
-      item["title"] = item["summary"]
-      
-      if post.find('video-caption') is not None:
-        caption = post.find('video-caption').text
-      else:
-        caption = ""
-      
-      content.write("%(player)s%(caption)s" % \
-                    {'player': post.find('video-player').text,
-                     'caption': caption})
-    #### audio ####
-    elif posttype == "audio":
-      item["title"] = item["summary"]
-      
-      if post.find('audio-caption') is not None:
-        caption = post.find('audio-caption').text
-      else:
-        caption = ""
-      
-      content.write("%(player)s%(caption)s" % \
-                    {'player': post.find('audio-player').text,
-                     'caption': caption})
-    #### answer ####
-    elif posttype == "answer":
-      item["title"] = item["summary"]
-      
-      content.write(
-        "<p><strong>Question</strong></p><p>%(question)s</p><p><strong>Answer</strong></p>%(answer)s" % \
-        {'question': post.find('question').text,
-         'answer': post.find('answer').text})
+      old_ids = set(dash.entry_ids)
+      dash.entry_ids = ids
+      new_ids = [entry_id for entry_id in dash.entry_ids if entry_id not in old_ids]
+      updates.append((dash, documents))
+      if account['hub'] and new_ids:
+        topics.setdefault(account['hub'], []).append(feed_url(account['url']))
+      messages.append("%s: Successfully updated (%d new entries)" % (email_s, len(new_ids)))
     
-    # Get reblog information, since that's, you know, kind of important
-    if post.attrib.has_key('reblogged-from-name'):
-      content.write('<p><em>reblogged from <a href="%(url)s">%(name)s</a></em></p>' % \
-                    {'url': post.attrib.get('reblogged-from-url'),
-                     'name': post.attrib.get('reblogged-from-name')})
+    failed = memcache.set_multi(entry_caches, key_prefix='entry-cache:')
+    for email_s in failed:
+      # Most likely over memcache's 1MB value limit; the account's entries
+      # are all serialized again next time, which is slower but correct
+      cache = entry_caches[email_s]
+      logging.warning('Could not cache %d entries (%d bytes) for %s', len(cache),
+                      sum([len(fragment) for fragment in cache.values()]), email_s)
+    store_documents(updates)
     
-    # Get tag information
-    if post.find('tag') is not None:
-      url = post.find('tumblelog').attrib.get('url')
-      content.write('<p><strong>Tags:</strong>')
-      for tag in post.getiterator('tag'):
-        text = tag.text
-        content.write(' <a href="%(tagurl)s">#%(text)s</a>' % \
-                      {'tagurl': url+'tagged/'+text,
-                       'text': text})
-      content.write('</p>')
-    
-    item["content"] = content.getvalue()
-    content.close()
-    atom.items.append(item)
-  
-  return atom.format_atom_string(pretty=True)
+    for hub, hub_topics in topics.items():
+      # Ping the hub from the task queue, so a slow hub never holds up the
+      # update; the queue retries failed pings with backoff (see queue.yaml)
+      taskqueue.add(queue_name='websub', url='/websub/publish',
+                    params={'hub': hub, 'hub.url': hub_topics})
+    self.response.headers['Content-Type'] = 'text/plain'
+    self.response.out.write('\n'.join(messages))
 
-class TumblrDashboard(db.Model):
-  """Models a TumblrDashboard entry with email identifier, raw XML, and Atom feed."""
-  # key = email
-  xml = db.TextProperty()
-  atom = db.TextProperty()
-
-class MainPage(webapp.RequestHandler):
-  def get(self):
-    self.response.out.write("<html><body>Under construction</body></html>")
+class PublishHub(webapp.RequestHandler):
+  def post(self):
+    """Run from the websub task queue after an update with new entries"""
+    ok, message = publish_to_hub(self.request.get('hub'),
+                                 self.request.get_all('hub.url'))
+    if not ok:
+      # A non-2xx status makes the task queue retry this ping later
+      logging.warning(message)
+      self.error(502)
+    self.response.out.write(message)
 
-class UpdateDB(webapp.RequestHandler):
+class LocalHub(webapp.RequestHandler):
+  """A stand-in WebSub hub, for trying out publishing without a real hub.
+  
+  Only routed on the development server. Set hub to
+  http://localhost:8080/websub/hub in config.ini; a GET lists the topics
+  that have been published (see also tools/check_websub.py).
+  """
   def get(self):
-    """To be run occasionally (via cron)"""
-    email_s = _config.get('tumblr','email')
-    xml = fetch_tumblr_dashboard_xml(email_s,_config.get('tumblr','password'))
+    from google.appengine.api import memcache
+    self.response.headers['Content-Type'] = 'text/plain'
+    self.response.out.write('\n'.join(memcache.get('websub-local-hub') or []))
   
-    if not xml[0]:
-      # If we can't fetch for some reason, let's bail
-      self.response.out.write(xml[1])
+  def post(self):
+    from google.appengine.api import memcache
+    if self.request.get('hub.mode') != 'publish':
+      self.error(400)
       return
-  
-    atom = xml_to_atom(xml[1],_config.get('feed','title'),
-                             _config.get('feed','description'),
-                             _config.get('feed','url'),
-                             email_s,
-                             int(_config.get('feed','img_size')))
-
-    dash = TumblrDashboard.get_or_insert(email_s)
-    dash.xml = db.Text(''.join(xml[1]), encoding="utf-8")
-    dash.atom = db.Text(atom, encoding="utf-8")
-    dash.put()
-    self.response.out.write("Successfully updated")
+    topics = self.request.get_all('hub.url')
+    pings = memcache.get('websub-local-hub') or []
+    pings.extend(['%s %s' % (time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), topic)
+                  for topic in topics])
+    memcache.set('websub-local-hub', pings[-100:])
+    logging.info('Local hub received publish for %s', ', '.join(topics))
+    self.response.set_status(204)
 
 class Tumblr(webapp.RequestHandler):
-  def get(self):
+  # Entry elements kept when a client asks for content=none
+  summary_fields = ('link', 'summary', 'published', 'author')
+  
+  def get(self,name=None):
+    """Serve the stored feed, or another one for ?n=, ?content=none and ?img="""
+    accounts = [account for account in settings.accounts() if account['name'] == name]
+    if not accounts:
+      self.error(404)
+      return
+    account = accounts[0]
+    limit = self.request.get('n')
+    content = self.request.get('content')
+    width = self.request.get('img')
+    
+    if limit:
+      try:
+        limit = int(limit)
+        if limit < 0:
+          raise ValueError
+      except ValueError:
+        self.error(400)
+        self.response.out.write("n must be a non-negative number")
+        return
+    else:
+      limit = None
+    if content not in ('', 'full', 'none'):
+      self.error(400)
+      self.response.out.write("content must be full or none")
+      return
+    if width:
+      try:
+        width = int(width)
+        if width <= 0:
+          raise ValueError
+      except ValueError:
+        self.error(400)
+        self.response.out.write("img must be a positive width in pixels")
+        return
+    else:
+      width = None
+    fields = content == 'none' and self.summary_fields or None
+    
+    # Fetch just the shards of the one document that's needed
+    dash = get_dashboards([account['email']])[0]
     self.response.headers['Content-Type'] = 'application/atom+xml'
-    email_s = _config.get('tumblr','email')
-
-    dash = TumblrDashboard.get_or_insert(email_s)
-    self.response.out.write(dash.atom)
+    if limit is None and fields is None and width is None:
+      self.response.out.write(load_documents([dash], 'atom')[0] or '')
+      return
+    
+    entries = load_documents([dash], 'entries', binary=True)[0]
+    if entries:
+      # Photo posts are resized from their manifests, without the XML
+      import cPickle as pickle
+      entries = pickle.loads(entries)
+    else:
+      # Stored before entries were; only the requested entries are rendered
+      from dashboard import iter_posts, iter_entries
+      xml = load_documents([dash], 'xml')[0]
+      if not xml:
+        return
+      entries = iter_entries(iter_posts(xml),account['img_size'],
+                             account['collapse_reblogs'])
+    self.response.out.write(render_feed(entries, account, limit=limit,
+                                        fields=fields, width=width))
 
-application = webapp.WSGIApplication([
+routes = [
   ('/', MainPage),
   ('/update', UpdateDB),
-  ('/atom.xml', Tumblr)
-], debug=True)
+  ('/websub/publish', PublishHub),
+  ('/atom.xml', Tumblr),
+  ('/([^/]+)/atom.xml', Tumblr)
+]
+if os.environ.get('SERVER_SOFTWARE', '').startswith('Development'):
+  # Anyone could write to the stand-in hub, so it stays off in production
+  routes.append(('/websub/hub', LocalHub))
+application = webapp.WSGIApplication(routes, debug=True)
 
 def main():
   run_wsgi_app(application)